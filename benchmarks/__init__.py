@@ -0,0 +1,8 @@
+'''
+Benchmarks for xmljson.
+
+- ``python -m benchmarks`` measures every dialect in both directions on synthetic corpora and
+  the test fixtures, and can save results or compare them with a saved baseline
+- ``python benchmarks/traversal.py`` compares .data() with the old recursive implementation
+- ``python benchmarks/cobra.py`` shows how Cobra .data() scales with depth
+'''
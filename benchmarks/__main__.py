@@ -0,0 +1,155 @@
+'''
+Measure .data(), .etree() and .to_xml_bytes() for every dialect on every corpus.
+
+For each, report nodes/s, MB/s (of the XML) and the peak memory traced by tracemalloc (Python
+objects only: lxml's own memory is not traced).
+
+Usage:
+    python -m benchmarks                            # print results
+    python -m benchmarks --save baseline.json       # save results as JSON
+    python -m benchmarks --compare baseline.json    # flag regressions against a saved run
+'''
+
+from __future__ import print_function
+
+import gc
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+
+import lxml.etree
+from lxml.etree import fromstring
+
+import xmljson
+from .corpora import corpora
+
+dialects = ['abdera', 'badgerfish', 'cobra', 'gdata', 'parker', 'yahoo']
+
+
+def best_time(fn, duration):
+    '''Return the best time for one call of fn, over 3 runs of about duration seconds each'''
+    start = time.time()
+    fn()
+    number = max(1, int(duration / max(time.time() - start, 1e-6)))
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def peak_memory(fn):
+    '''Return the peak bytes allocated by Python objects while running fn (None on Python 2)'''
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(size=20000, duration=0.2, names=None, shapes=None):
+    '''Return {"dialect/corpus/direction": {seconds, nodes_per_s, mb_per_s, peak_kb}}'''
+    results = {}
+    for corpus, xml in corpora(size):
+        if shapes and corpus not in shapes:
+            continue
+        root = fromstring(xml)
+        nodes = sum(1 for node in root.iter())
+        for name in dialects:
+            if names and name not in names:
+                continue
+            dialect = getattr(xmljson, name)
+            data = dialect.data(root)
+            for direction, fn in [('data', lambda: dialect.data(root)),
+                                  ('etree', lambda: dialect.etree(data)),
+                                  ('xml_bytes', lambda: dialect.to_xml_bytes(data))]:
+                gc.collect()
+                seconds = best_time(fn, duration)
+                peak = peak_memory(fn)
+                key = '%s/%s/%s' % (name, corpus, direction)
+                results[key] = {
+                    'seconds': seconds,
+                    'nodes_per_s': nodes / seconds,
+                    'mb_per_s': len(xml) / 1e6 / seconds,
+                    'peak_kb': None if peak is None else peak / 1024.0,
+                }
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''Return {key: [reasons]} for results that are slower or use more memory than baseline'''
+    regressions = {}
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        reasons = []
+        if result['seconds'] > base['seconds'] * (1 + threshold):
+            reasons.append('%.0f%% slower' % ((result['seconds'] / base['seconds'] - 1) * 100))
+        if result['peak_kb'] and base['peak_kb'] and \
+                result['peak_kb'] > base['peak_kb'] * (1 + threshold):
+            reasons.append('%.0f%% more memory' % (
+                (result['peak_kb'] / base['peak_kb'] - 1) * 100))
+        if reasons:
+            regressions[key] = reasons
+    return regressions
+
+
+def report(results, regressions=None, out=sys.stdout):
+    print('%-34s %12s %9s %10s' % ('dialect/corpus/direction', 'nodes/s', 'MB/s', 'peak KB'),
+          file=out)
+    for key in sorted(results):
+        result = results[key]
+        peak = '-' if result['peak_kb'] is None else '%.0f' % result['peak_kb']
+        flag = ', '.join((regressions or {}).get(key, []))
+        print('%-34s %12.0f %9.2f %10s  %s' % (
+            key, result['nodes_per_s'], result['mb_per_s'], peak, flag), file=out)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=20000,
+                        help='approximate elements per synthetic corpus (default: 20000)')
+    parser.add_argument('--time', type=float, default=0.2,
+                        help='seconds per timing run (default: 0.2)')
+    parser.add_argument('-d', '--dialect', action='append', choices=dialects,
+                        help='only these dialects (can be repeated)')
+    parser.add_argument('-c', '--corpus', action='append',
+                        help='only these corpora, e.g. wide, abdera-1 (can be repeated)')
+    parser.add_argument('--save', metavar='FILE', help='save results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='compare with results saved earlier')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='flag results slower or larger than the baseline by this fraction '
+                        '(default: 0.1)')
+    args = parser.parse_args(args)
+
+    results = run(args.size, args.time, args.dialect, args.corpus)
+    regressions = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)['results']
+        regressions = compare(results, baseline, args.threshold)
+    report(results, regressions)
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump({
+                'python': platform.python_version(),
+                'lxml': '.'.join(str(v) for v in lxml.etree.LXML_VERSION),
+                'xmljson': xmljson.__version__,
+                'size': args.size,
+                'results': results,
+            }, handle, indent=2, sort_keys=True)
+    if regressions:
+        print('%d regressions against %s' % (len(regressions), args.compare))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+'''
+Show how Cobra .data() time scales with document depth. It should grow linearly.
+
+Usage: python benchmarks/cobra.py
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+from lxml.etree import Element, SubElement
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xmljson      # noqa: E402
+
+
+def nested(depth):
+    '''<a><b x="1"/><a><b x="1"/>...</a></a>: Cobra used to convert this 2^depth times'''
+    root = elem = Element('a')
+    for level in range(depth):
+        SubElement(elem, 'b', x='1')
+        elem = SubElement(elem, 'a')
+    return root
+
+
+def main(repeat=5):
+    previous = None
+    for depth in [5, 10, 20, 40, 80, 160]:
+        root = nested(depth)
+        nodes = sum(1 for node in root.iter())
+        number = max(1, 10000 // nodes)
+        best = min(timeit.repeat(lambda: xmljson.cobra.data(root),
+                                 number=number, repeat=repeat)) / number
+        growth = '' if previous is None else '%5.1fx' % (best / previous)
+        print('depth %4d  %5d nodes  %8.3f ms  %6.2f us/node  %s' % (
+            depth, nodes, best * 1e3, best / nodes * 1e6, growth))
+        previous = best
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''
+Show the memory .data() uses with and without compact=True on large documents.
+
+Usage: python benchmarks/compact.py
+'''
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import tracemalloc
+
+from lxml.etree import fromstring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xmljson                                  # noqa: E402
+from benchmarks.corpora import corpora          # noqa: E402
+
+
+def retained(dialect, root):
+    '''Return the bytes held by the result of dialect.data(root)'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        data = dialect.data(root)       # noqa: F841 keep the result alive while measuring
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main(size=100000):
+    for corpus, xml in corpora(size)[:5]:
+        root = fromstring(xml)
+        for name in ['badgerfish', 'gdata', 'parker', 'yahoo']:
+            cls = type(getattr(xmljson, name))
+            default, compact = retained(cls(), root), retained(cls(compact=True), root)
+            print('%-10s %-10s %8.1f MB  compact %8.1f MB  %4.0f%% less' % (
+                corpus, name, default / 1e6, compact / 1e6, 100 - compact * 100.0 / default))
+
+
+if __name__ == '__main__':
+    main()
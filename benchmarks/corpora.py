@@ -0,0 +1,77 @@
+'''
+Synthetic XML documents of different shapes, plus the test fixtures, for benchmarks.
+
+Each generator takes a size (roughly the number of elements) and returns UTF-8 bytes.
+'''
+
+import io
+import os
+
+_tests = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+
+
+def wide(size):
+    '''Many small, similar records under one root, like a feed or a table export'''
+    items = ''.join(
+        '<item id="%d"><name>Name %d</name><price>%d.25</price><active>true</active></item>' %
+        (i, i, i) for i in range(size // 4))
+    return ('<root>%s</root>' % items).encode('utf-8')
+
+
+def deep(size, depth=200):
+    '''Chains of nested elements, each with an attribute and a sibling leaf. (etree() is
+    recursive, so chains stay well within the recursion limit)'''
+    chain = '<a n="0">' + '<b>1</b><a n="1">' * depth + 'leaf' + '</a>' * (depth + 1)
+    return ('<root>%s</root>' % (chain * max(1, size // (2 * depth)))).encode('utf-8')
+
+
+def attributes(size):
+    '''Elements with many attributes and no text, like configuration or GIS data'''
+    attrs = ' '.join('a%d="%d"' % (i, i * 7) for i in range(10))
+    return ('<root>%s</root>' % (('<node %s/>' % attrs) * size)).encode('utf-8')
+
+
+def text(size):
+    '''Paragraphs of long, non-numeric text, like documents or articles'''
+    para = 'The quick brown fox jumps over the lazy dog &amp; keeps running. ' * 4
+    return ('<doc>%s</doc>' % ''.join(
+        '<p lang="en">%s</p>' % para for i in range(size))).encode('utf-8')
+
+
+def mixed(size):
+    '''Nested records with repeated and unique children, text with children, comments,
+    namespaces and values that look like numbers and booleans'''
+    record = (
+        u'<entry xmlns:m="urn:meta" m:id="%d"><!-- note -->'
+        u'<title>Entry %d café</title><m:score>%d.5e1</m:score><flag>false</flag>'
+        u'<tags><tag>a</tag><tag>b</tag><tag>%d</tag></tags>'
+        u'<body>Intro<em>bold</em><br/>rest</body></entry>')
+    return (u'<feed>%s</feed>' % u''.join(
+        record % (i, i, i, i) for i in range(size // 12))).encode('utf-8')
+
+
+def catalog(size):
+    '''Records that repeat a few identical blocks, like addresses or units in a catalog'''
+    blocks = [
+        '<address><city>City %d</city><zip>%05d</zip><country>XX</country></address>'
+        '<unit system="metric"><name>kg</name><factor>1</factor></unit>' % (i, i)
+        for i in range(10)]
+    return ('<catalog>%s</catalog>' % ''.join(
+        '<product sku="%d">%s</product>' % (i, blocks[i % 10])
+        for i in range(size // 9))).encode('utf-8')
+
+
+def fixtures():
+    '''Return [(name, bytes)] for the tests/abdera-*.xml files'''
+    result = []
+    for index in range(1, 5):
+        name = 'abdera-%d' % index
+        with io.open(os.path.join(_tests, name + '.xml'), 'rb') as handle:
+            result.append((name, handle.read()))
+    return result
+
+
+def corpora(size=20000):
+    '''Return [(name, bytes)] for all synthetic shapes at the given size, then the fixtures'''
+    shapes = [wide, deep, attributes, text, mixed, catalog]
+    return [(shape.__name__, shape(size)) for shape in shapes] + fixtures()
@@ -0,0 +1,31 @@
+'''
+Show the memory .data() uses with and without shared=True on large documents.
+
+Usage: python benchmarks/shared.py
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+
+from lxml.etree import fromstring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xmljson                                  # noqa: E402
+from benchmarks.compact import retained         # noqa: E402
+from benchmarks.corpora import catalog, mixed, wide     # noqa: E402
+
+
+def main(size=100000):
+    for shape in [catalog, wide, mixed]:
+        root = fromstring(shape(size))
+        for name in ['badgerfish', 'parker']:
+            cls = type(getattr(xmljson, name))
+            default, shared = retained(cls(), root), retained(cls(shared=True), root)
+            print('%-10s %-10s %8.1f MB  shared %8.1f MB  %4.0f%% less' % (
+                shape.__name__, name, default / 1e6, shared / 1e6, 100 - shared * 100.0 / default))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Compare the per-node cost of .data() against the recursive implementation it replaced.
+
+Usage: python benchmarks/traversal.py
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+from collections import Counter
+
+from lxml.etree import Element, SubElement
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xmljson      # noqa: E402
+
+
+def recursive_data(self, root):
+    '''XMLData.data() as it was before the explicit-stack traversal'''
+    value = self.dict()
+    children = [node for node in root if isinstance(node.tag, str)]
+    for attr, attrval in root.attrib.items():
+        attr = attr if self.attr_prefix is None else self.attr_prefix + attr
+        value[attr] = self._fromstring(attrval)
+    if root.text and self.text_content is not None:
+        text = root.text
+        if text.strip():
+            if self.simple_text and len(children) == len(root.attrib) == 0:
+                value = self._fromstring(text)
+            else:
+                value[self.text_content] = self._fromstring(text)
+    count = Counter(child.tag for child in children)
+    for child in children:
+        if count[child.tag] == 1:
+            value.update(recursive_data(self, child))
+        else:
+            result = value.setdefault(child.tag, self.list())
+            result += recursive_data(self, child).values()
+    if isinstance(value, dict) and not value and self.simple_text:
+        value = ''
+    return self.dict([(root.tag, value)])
+
+
+def deep(depth):
+    '''<a x="1"><a x="1">...<a>1</a>...</a></a>'''
+    root = elem = Element('a', x='1')
+    for level in range(depth - 1):
+        elem = SubElement(elem, 'a', x='1')
+    elem.text = '1'
+    return root
+
+
+def wide(width):
+    '''<root><a x="1"><b>1</b><c>2</c></a>... width times</root>'''
+    root = Element('root')
+    for index in range(width):
+        child = SubElement(root, 'a', x='1')
+        SubElement(child, 'b').text = '1'
+        SubElement(child, 'c').text = '2'
+    return root
+
+
+def main(repeat=5):
+    docs = [('deep (900 levels)', deep(900)), ('wide (10,000 records)', wide(10000))]
+    for dialect_name in ['badgerfish', 'gdata', 'yahoo']:
+        dialect = getattr(xmljson, dialect_name)
+        for doc_name, root in docs:
+            nodes = sum(1 for node in root.iter())
+            for label, fn in [('recursive', lambda: recursive_data(dialect, root)),
+                              ('stack', lambda: dialect.data(root))]:
+                number = max(1, 20000 // nodes)
+                best = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+                print('%-10s %-22s %-10s %6.2f us/node' % (
+                    dialect_name, doc_name, label, best / nodes * 1e6))
+
+
+if __name__ == '__main__':
+    main()
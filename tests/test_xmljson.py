@@ -12,6 +12,8 @@ import io
 import os
 import sys
 import json
+import pickle
+import itertools
 import unittest
 
 from collections import OrderedDict as Dict
@@ -21,10 +23,15 @@ import lxml.html
 import lxml.etree
 import xml.etree.cElementTree
 import xmljson
-from xmljson.__main__ import main, parse, closing
+from xmljson.__main__ import main, parse, parse_args, parse_options, closing, bulk, find_files
 
 _folder = os.path.dirname(os.path.abspath(__file__))
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # For Python 3, decode byte strings as UTF-8
 if sys.version_info[0] == 3:
     def decode(s):
@@ -63,11 +70,1256 @@ class TestCLI(unittest.TestCase):
                 with closing(in_file), closing(out_file):
                     self.assertEqual(json.load(out_file), dialect.data(parse(in_file).getroot()))
 
+    def test_stream(self):
+        'CLI --stream writes one JSON line per record'
+        path = os.path.join(_folder, 'abdera-3.xml')
+        options = parse_options(['--stream', '--record-tag', 'root/*', path])[3]
+        # parse_args() still returns (in_file, out_file, dialect)
+        in_file, out_file, dialect = parse_args(['--stream', '--record-tag', 'root/*', path])
+        self.assertIsInstance(dialect, xmljson.Parker)
+        in_file.close()
+        self.assertEqual(options['stream'], True)
+        self.assertEqual(options['record_tag'], 'root/*')
+        for dialect in TestIterData.dialects:
+            main(io.open(path, encoding='utf-8'), openwrite(self.tmp), dialect, **options)
+            with io.open(self.tmp, encoding='utf-8') as handle:
+                lines = handle.readlines()
+            root = parse(path).getroot()
+            self.assertEqual(len(lines), len(root))
+            for line, child in zip(lines, root):
+                self.assertNotIn(' ', line)
+                self.assertEqual(json.loads(line), dialect.data(child))
+
+    def test_bulk(self):
+        'CLI --bulk converts files, globs and directories, in parallel, and reports failures'
+        import shutil
+        import tempfile
+        folder = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(folder, 'in', 'sub'))
+            names = ['abdera-1.xml', 'abdera-2.xml', 'abdera-3.xml', 'sub/abdera-4.xml']
+            for name in names:
+                with openwrite(os.path.join(folder, 'in', name)) as handle:
+                    handle.write(read(os.path.basename(name)))
+            with openwrite(os.path.join(folder, 'in', 'bad.xml')) as handle:
+                handle.write(u'<a>')
+            expected = [xmljson.gdata.data(parse(os.path.join(folder, 'in', name)).getroot())
+                        for name in names]
+            options = parse_options(['--bulk', os.path.join(folder, 'in'), '--out-dir', 'x',
+                                     '-j', '2', '-d', 'gdata'])[3]
+            self.assertEqual(options['bulk'], [os.path.join(folder, 'in')])
+            self.assertEqual((options['out_dir'], options['jobs']), ('x', 2))
+            for jobs in [1, 2]:
+                # One .json per file in --out-dir, keeping the folder structure
+                out_dir = os.path.join(folder, 'out-%d' % jobs)
+                log = io.StringIO()
+                failures = bulk([os.path.join(folder, 'in')], None, xmljson.gdata,
+                                out_dir=out_dir, jobs=jobs, log=log)
+                self.assertEqual(failures, 1)
+                self.assertIn('converted 4 of 5 files', log.getvalue())
+                self.assertIn('bad.xml', log.getvalue())
+                for name, data in zip(names, expected):
+                    path = os.path.join(out_dir, name.replace('.xml', '.json'))
+                    with io.open(path, encoding='utf-8') as handle:
+                        self.assertEqual(json.load(handle), data)
+                # --ndjson shards in --out-dir, in order, from globs and files
+                patterns = [os.path.join(folder, 'in', 'abdera-*.xml'),
+                            os.path.join(folder, 'in', 'sub', 'abdera-4.xml'),
+                            os.path.join(folder, 'missing.xml')]
+                shards = os.path.join(folder, 'shards-%d' % jobs)
+                failures = bulk(patterns, None, xmljson.gdata, out_dir=shards, ndjson=True,
+                                shard_size=3, jobs=jobs, log=io.StringIO())
+                self.assertEqual(failures, 1)
+                self.assertEqual(sorted(os.listdir(shards)),
+                                 ['part-00000.ndjson', 'part-00001.ndjson'])
+                lines = []
+                for name in sorted(os.listdir(shards)):
+                    with io.open(os.path.join(shards, name), encoding='utf-8') as handle:
+                        lines.extend(handle.readlines())
+                self.assertEqual([json.loads(line) for line in lines], expected)
+            # --ndjson without --out-dir writes to out_file
+            out = io.StringIO()
+            bulk(patterns[:1], out, xmljson.gdata, ndjson=True, log=io.StringIO())
+            self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()],
+                             expected[:3])
+            # Globs keep the folders after their first wildcard, so names do not collide
+            with openwrite(os.path.join(folder, 'in', 'sub', 'abdera-1.xml')) as handle:
+                handle.write(read('abdera-1.xml'))
+            pattern = os.path.join(folder, 'in', '*', 'abdera-1.xml')
+            self.assertEqual([name for path, name in find_files([pattern])],
+                             [os.path.join('sub', 'abdera-1.xml')])
+            pattern = os.path.join(folder, 'in', '**', 'abdera-1.xml')
+            out_dir = os.path.join(folder, 'out-glob')
+            self.assertEqual(bulk([os.path.join(folder, 'in', 'abdera-1.xml'), pattern], None,
+                                  xmljson.gdata, out_dir=out_dir, log=io.StringIO()), 0)
+            self.assertEqual(sorted(os.listdir(out_dir)), ['abdera-1.json', 'sub'])
+            # Files that would write the same .json are an error
+            with self.assertRaises(ValueError):
+                bulk([os.path.join(folder, 'in', 'abdera-1.xml'),
+                      os.path.join(folder, 'in', 'sub', 'abdera-1.xml')], None, xmljson.gdata,
+                     out_dir=out_dir, log=io.StringIO())
+        finally:
+            shutil.rmtree(folder)
+
+    def test_indent(self):
+        'CLI --compact and --indent N set the JSON layout'
+        path = os.path.join(_folder, 'abdera-1.xml')
+        self.assertEqual(parse_options([path])[3]['indent'], 2)
+        self.assertEqual(parse_options(['--compact', path])[3]['indent'], None)
+        self.assertEqual(parse_options(['--indent', '4', path])[3]['indent'], 4)
+        data = xmljson.parker.data(parse(path).getroot())
+        for indent in [None, 0, 2, 4]:
+            main(io.open(path, 'rb'), openwrite(self.tmp), xmljson.parker, indent=indent)
+            with io.open(self.tmp, encoding='utf-8') as handle:
+                self.assertEqual(handle.read(), json.dumps(
+                    data, indent=indent, separators=(',', ':' if indent is None else ': ')))
+
+    def test_utf8(self):
+        'CLI writes non-ASCII characters as \\uXXXX, like json.dump(). --utf8 writes UTF-8'
+        xml = u'<a><b>caf\u00e9</b><b>\u2603</b></a>'.encode('utf-8')
+        path = os.path.join(_folder, 'abdera-1.xml')
+        self.assertEqual(parse_options(['--utf8', path])[3]['utf8'], True)
+        for options, expected in [({}, b'"caf\\u00e9"'), ({'utf8': True}, b'"caf\xc3\xa9"'),
+                                  ({'stream': True, 'record_tag': 'b'}, b'"caf\\u00e9"')]:
+            main(io.BytesIO(xml), openwrite(self.tmp), xmljson.parker, **options)
+            with io.open(self.tmp, 'rb') as handle:
+                output = handle.read()
+            self.assertIn(expected, output)
+            if not options:
+                self.assertEqual(output, json.dumps(
+                    xmljson.parker.data(fromstring(xml)), indent=2).encode('ascii'))
+
     def tearDown(self):
         if os.path.exists(self.tmp):
             os.remove(self.tmp)
 
 
+class TestIterData(unittest.TestCase):
+    dialects = [xmljson.Abdera(), xmljson.BadgerFish(), xmljson.Cobra(),
+                xmljson.GData(), xmljson.Parker(), xmljson.Yahoo()]
+
+    def test_records(self):
+        'iterdata() yields the same records as data() on each element'
+        xml = ('<rss><channel><title>x</title>' + ''.join(
+            '<item id="%d"><title>T%d</title><price>%d.5</price><tag>a</tag><tag>b</tag></item>' %
+            (i, i, i) for i in range(20)) + '</channel></rss>').encode('utf-8')
+        for dialect in self.dialects:
+            expected = [dialect.data(item) for item in fromstring(xml).iter('item')]
+            for tag in ['item', 'channel/item', '/rss/channel/item', '*/item']:
+                self.assertEqual(list(dialect.iterdata(io.BytesIO(xml), tag)), expected)
+            self.assertEqual(list(dialect.iterdata(io.BytesIO(xml), '/channel/item')), [])
+        self.assertEqual(
+            list(xmljson.parker.iterdata(io.BytesIO(xml), 'item', preserve_root=True))[0],
+            xmljson.parker.data(next(fromstring(xml).iter('item')), preserve_root=True))
+
+    def test_fixtures(self):
+        'iterdata() matches data() on the sample files'
+        for dialect in self.dialects:
+            for path in ['abdera-1.xml', 'abdera-2.xml', 'abdera-3.xml', 'abdera-4.xml']:
+                path = os.path.join(_folder, path)
+                root = parse(path).getroot()
+                self.assertEqual(list(dialect.iterdata(path, root.tag)), [dialect.data(root)])
+
+    def test_memory(self):
+        'iterdata() clears processed records'
+        xml = ('<root>' + '<item><a>1</a></item>' * 100 + '</root>').encode('utf-8')
+        events = lxml.etree.iterparse(io.BytesIO(xml), events=('start', 'end'))
+        for elem in xmljson._iterrecords(events, 'item'):
+            # Only the previous record remains before this one, and it is empty
+            self.assertLessEqual(elem.getparent().index(elem), 1)
+            if elem.getprevious() is not None:
+                self.assertEqual(len(elem.getprevious()), 0)
+
+
+class _Body(object):
+    '''An async byte stream, like an HTTP response body, that returns size bytes at a time'''
+    def __init__(self, data, size, iterate=False):
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        if not iterate:
+            self.read = self._read
+
+    def _result(self, chunk):
+        import asyncio
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(chunk)
+        return future
+
+    def _read(self, size):
+        return self._result(self.chunks.pop(0) if self.chunks else b'')
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self.chunks:
+            return self._result(self.chunks.pop(0))
+        raise StopAsyncIteration        # noqa: F821 Python 3 only
+
+
+@unittest.skipIf(sys.version_info < (3, 6), 'aiter_data() needs Python 3.6+')
+class TestAsync(unittest.TestCase):
+    def collect(self, records):
+        'Return all values from an async iterator'
+        import asyncio
+        loop, result = asyncio.new_event_loop(), []
+        try:
+            while True:
+                result.append(loop.run_until_complete(records.__anext__()))
+        except StopAsyncIteration:          # noqa: F821 Python 3 only
+            return result
+        finally:
+            loop.close()
+
+    def test_aiter_data(self):
+        'aiter_data() yields what iterdata() does, for any chunks, in or out of the event loop'
+        xml = ('<rss><channel><title>x</title>' + ''.join(
+            '<item id="%d"><title>T%d</title><tag>a</tag><tag>b</tag></item>' % (i, i)
+            for i in range(20)) + '</channel></rss>').encode('utf-8')
+        for dialect in TestIterData.dialects:
+            expected = list(dialect.iterdata(io.BytesIO(xml), 'channel/item'))
+            for size, iterate, limit in [(7, False, None), (100, True, 1), (10000, False, 1)]:
+                records = dialect.aiter_data(_Body(xml, size, iterate), 'channel/item',
+                                             executor_size=limit)
+                self.assertEqual(self.collect(records), expected)
+        filters = dict(include=['item/title'], exclude=['item/title'])
+        self.assertEqual(
+            self.collect(xmljson.badgerfish.aiter_data(_Body(xml, 50), 'item', **filters)),
+            list(xmljson.badgerfish.iterdata(io.BytesIO(xml), 'item', **filters)))
+
+    def test_threads(self):
+        'aiter_data() only uses the parser in the event loop thread, even with an executor'
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        threads = set()
+
+        class Parser(lxml.etree.XMLPullParser):
+            def read_events(self):
+                threads.add(threading.current_thread())
+                return super(Parser, self).read_events()
+
+        xml = b'<rss><channel>' + b'<item><t>1</t></item>' * 50 + b'</channel></rss>'
+        expected = list(xmljson.parker.iterdata(io.BytesIO(xml), 'item', include=['channel']))
+        parser, xmljson.aio.XMLPullParser = xmljson.aio.XMLPullParser, Parser
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                records = xmljson.parker.aiter_data(_Body(xml, 100), 'item', include=['channel'],
+                                                    executor=executor, executor_size=1)
+                self.assertEqual(self.collect(records), expected)
+        finally:
+            xmljson.aio.XMLPullParser = parser
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+    def test_errors(self):
+        'aiter_data() raises errors in the XML'
+        with self.assertRaises(lxml.etree.XMLSyntaxError):
+            self.collect(xmljson.badgerfish.aiter_data(_Body(b'<a><b/><b>', 3), 'b'))
+
+
+class TestFeeder(unittest.TestCase):
+    docs = [
+        b'<?xml version="1.0"?>\n<!-- c --><rss a=">"><channel>' + b''.join(
+            b'<item id="%d"><title>T</title><rss>x</rss></item>' % i for i in range(5)) +
+        b'<!-- </rss> --></channel></rss>',
+        b'<rss/>',
+        b'  <x:rss xmlns:x="urn:a"><x:item>1</x:item></x:rss >\n',
+        b'<rss><item><![CDATA[</rss>]]></item></rss>',
+        b'<a/>', b'<b/>', b'<c></c>\n', b'<d x="1"/>',
+        b'<?xml version="1.0"?><e>2</e>',
+    ]
+
+    def test_feed(self):
+        'feeder() converts concatenated documents fed in chunks of any size'
+        stream = b''.join(self.docs)
+        for dialect in TestIterData.dialects:
+            items = [value for doc in self.docs
+                     for value in dialect.iterdata(io.BytesIO(doc), '*/item')]
+            roots = [dialect.data(fromstring(doc)) for doc in self.docs]
+            for size in [1, 3, 6, 7, 50, 1000]:
+                for tag, expected in [('*/item', items), (None, roots)]:
+                    result = []
+                    feeder = dialect.feeder(tag, callback=result.append)
+                    for index in range(0, len(stream), size):
+                        feeder.feed(stream[index:index + size])
+                    feeder.close()
+                    self.assertEqual(result, expected)
+
+    def test_queue(self):
+        'Without a callback, read_records() returns the records so far'
+        feeder = xmljson.badgerfish.feeder('item', exclude=['item/title'])
+        feeder.feed(self.docs[0][:120])
+        first = list(feeder.read_records())
+        feeder.feed(self.docs[0][120:])
+        feeder.close()
+        records = first + list(feeder.read_records())
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0], Dict([('item', Dict([
+            ('@id', 0), ('rss', Dict([('$', 'x')]))]))]))
+        self.assertEqual(list(feeder.read_records()), [])
+
+    def test_errors(self):
+        'Incomplete documents raise an error on close()'
+        feeder = xmljson.badgerfish.feeder()
+        feeder.feed(b'<a/><a><b>')
+        with self.assertRaises(lxml.etree.XMLSyntaxError):
+            feeder.close()
+        self.assertEqual(list(feeder.read_records()), [Dict([('a', Dict())])])
+
+
+class TestCache(unittest.TestCase):
+    doc = b'<rates><rate currency="USD">1.1</rate><rate currency="EUR">0.9</rate></rates>'
+
+    def test_memory(self):
+        'cache().convert() returns copies of cached results, dropping the least recently used'
+        cache = xmljson.badgerfish.cache(size=2)
+        expected = xmljson.badgerfish.data(fromstring(self.doc))
+        for index in range(3):
+            result = cache.convert(self.doc)
+            self.assertEqual(result, expected)
+            result['rates']['rate'].append('changed')
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (2, 0, 1))
+        # Keyword arguments and the text of the document are part of the key
+        self.assertEqual(cache.convert(self.doc.decode('utf-8'), exclude=['rate']),
+                         Dict([('rates', Dict())]))
+        self.assertEqual(cache.convert(b'<a/>'), Dict([('a', Dict())]))
+        self.assertEqual(len(cache), 2)
+        cache.convert(self.doc)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+    def test_shared(self):
+        'Frozen results from shared=True are returned as-is'
+        cache = xmljson.Parker(shared=True).cache()
+        self.assertIs(cache.convert(self.doc), cache.convert(self.doc))
+
+    def test_disk(self):
+        'cache(path=...) stores results in SQLite for other caches of the same dialect options'
+        import shutil
+        import tempfile
+        folder = tempfile.mkdtemp()
+        path = os.path.join(folder, 'cache.db')
+        try:
+            caches = [xmljson.BadgerFish().cache(path=path), xmljson.GData().cache(path=path),
+                      xmljson.BadgerFish(shared=True).cache(path=path)]
+            for cache in caches:
+                cache.convert(self.doc)
+            later = [xmljson.BadgerFish().cache(path=path), xmljson.GData().cache(path=path),
+                     xmljson.BadgerFish(shared=True).cache(path=path)]
+            for cache in later:
+                self.assertEqual(cache.convert(self.doc),
+                                 cache.dialect.data(fromstring(self.doc)))
+                self.assertEqual(cache.convert(self.doc), cache.convert(self.doc))
+                self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (2, 1, 0))
+                self.assertIsInstance(cache.convert(self.doc), cache.dialect.dict)
+            self.assertIsInstance(later[2].convert(self.doc), xmljson.FrozenOrderedDict)
+            for cache in caches + later:
+                cache.close()
+            # Functions that cannot be pickled by name may differ across processes
+            with self.assertRaises(ValueError):
+                xmljson.Parker(xml_fromstring=lambda v: v).cache(path=path)
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestColumns(unittest.TestCase):
+    xml = (b'<doc><rows><row id="1"><name>a</name><v>1.5</v></row>'
+           b'<row id="2" x="y"><name>b</name><v>2</v><tag>p</tag><tag>q</tag></row>'
+           b'<row id="3"/></rows><row>9</row></doc>')
+
+    def test_columns(self):
+        'columns() flattens records into columns, from a tree or a file'
+        root = fromstring(self.xml)
+        before = tostring(root)
+        expected = Dict([('@id', [1, 2, 3]), ('name/$', ['a', 'b', None]),
+                         ('v/$', [1.5, 2, None]), ('@x', [None, 'y', None]),
+                         ('tag', [None, [Dict([('$', 'p')]), Dict([('$', 'q')])], None])])
+        self.assertEqual(xmljson.badgerfish.columns(root, 'rows/row'), expected)
+        self.assertEqual(xmljson.badgerfish.columns(io.BytesIO(self.xml), 'rows/row'), expected)
+        self.assertEqual(tostring(root), before)
+        # Empty records add no column. Records that are just a value are a column of their own
+        self.assertEqual(xmljson.parker.columns(root, 'row', missing='NA', exclude=['tag']), Dict([
+            ('name', ['a', 'b', 'NA', 'NA']), ('v', [1.5, 2, 'NA', 'NA']),
+            ('row', ['NA', 'NA', 'NA', 9])]))
+        self.assertEqual(xmljson.gdata.columns(root, '/doc/row'), Dict([('$t', [9])]))
+        self.assertEqual(xmljson.gdata.columns(root, 'missing'), Dict())
+
+    def test_batches(self):
+        'itercolumns() yields the columns of each batch of records'
+        batches = list(xmljson.parker.itercolumns(io.BytesIO(self.xml), 'row', size=2))
+        self.assertEqual(batches, [
+            Dict([('name', ['a', 'b']), ('v', [1.5, 2]), ('tag', [None, ['p', 'q']])]),
+            Dict([('name', [None, None]), ('v', [None, None]), ('tag', [None, None]),
+                  ('row', [None, 9])])])
+        self.assertEqual(list(xmljson.parker.itercolumns(io.BytesIO(self.xml), 'x')), [])
+        # A batch of empty records still has the columns, and so the count of records
+        xml = b'<rows><row><a>1</a></row><row/><row/><row/><row><a>2</a></row></rows>'
+        batches = list(xmljson.parker.itercolumns(io.BytesIO(xml), 'row', size=2, missing=0))
+        self.assertEqual(batches, [Dict([('a', [1, 0])]), Dict([('a', [0, 0])]),
+                                   Dict([('a', [2])])])
+
+    def test_arrays(self):
+        'arrays= returns typed columns'
+        from array import array
+        columns = xmljson.gdata.columns(fromstring(self.xml), 'rows/row', arrays='array')
+        self.assertEqual(columns['id'], array('q', [1, 2, 3]))
+        self.assertEqual(columns['v/$t'], [1.5, 2, None])
+        # Ints and floats are floats. Columns with gaps, or other types, stay lists
+        xml = b'<rows><row><v>1.5</v><n>x</n></row><row><v>2</v></row></rows>'
+        columns = xmljson.parker.columns(fromstring(xml), 'row', arrays='array')
+        self.assertEqual(columns, Dict([('v', array('d', [1.5, 2])), ('n', ['x', None])]))
+        with self.assertRaises(ValueError):
+            xmljson.parker.columns(fromstring(self.xml), 'row', arrays='pandas')
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numpy(self):
+        'arrays="numpy" returns NumPy arrays, masked where values are missing'
+        columns = xmljson.gdata.columns(fromstring(self.xml), 'rows/row', arrays='numpy')
+        self.assertEqual(columns['id'].dtype, numpy.int64)
+        self.assertEqual(columns['id'].tolist(), [1, 2, 3])
+        self.assertEqual(columns['v/$t'].dtype, numpy.float64)
+        self.assertEqual(columns['v/$t'].mask.tolist(), [False, False, True])
+        self.assertEqual(columns['name/$t'].dtype, object)
+        self.assertEqual(columns['tag'][1], [Dict([('$t', 'p')]), Dict([('$t', 'q')])])
+
+
+class TestPack(unittest.TestCase):
+    xml = '<s><r><v>1.5</v><v>2</v></r><r><i>1</i><i>2</i></r><r><i>a</i><i>2</i></r></s>'
+
+    def test_pack(self):
+        'pack=True returns lists of numbers as arrays'
+        import pickle
+        from array import array
+        parker = xmljson.Parker(pack=True)
+        result = parker.data(fromstring(self.xml))
+        self.assertEqual(result, Dict([('r', [
+            Dict([('v', array('d', [1.5, 2]))]), Dict([('i', array('q', [1, 2]))]),
+            Dict([('i', ['a', 2])])])]))
+        self.assertEqual(parker.data(fromstring('<l><i>1</i><i>2</i></l>')),
+                         Dict([('i', array('q', [1, 2]))]))
+        self.assertEqual(pickle.loads(pickle.dumps(parker)).data(fromstring(self.xml)), result)
+        # Arrays are written back as lists. (Floats are written as floats)
+        xml = '<s><r><v>1.5</v><v>2.0</v></r><r><i>1</i><i>2</i></r><r><i>a</i><i>2</i></r></s>'
+        self.assertEqual(decode(tostring(parker.etree(result, fromstring('<s/>')))), xml)
+        self.assertEqual(decode(parker.to_xml_bytes(result, 's')), xml)
+        # Leaf roots convert to a value, or None, which are returned as-is
+        for xml, value in [('<a>1</a>', 1), ('<a/>', None)]:
+            self.assertEqual(parker.data(fromstring(xml)), value)
+            self.assertEqual(parker.data(fromstring(xml), preserve_root=True),
+                             Dict([('a', value)]))
+        with self.assertRaises(ValueError):
+            xmljson.Parker(pack=True, shared=True)
+
+    def test_batch(self):
+        'batch=True converts rows of leaves in bulk, with the same result'
+        rows = [
+            ['1', '-2', '+3', '40'], ['1.5', '2', '.5', '1e3'], ['1.5', '2.5', '3.5', '4E-1'],
+            ['1', '2', '3', 'x'], ['1.5', '2.5', '3.5', '1e999'], ['1.0', '2.0', 'nan', '4.0'],
+            ['1', '2', '3', '9' * 5000], [' 1 ', '\n2\n', '3', '4'],
+            [' 1.5', '2.5\n', '3.5', '4.5'], ['1', '2', '3', 'true'], ['1', '2', '3', ''],
+            ['1', '2', '3', '1_0'], [u'\u0661', u'\u0662.5', '3', '4'], ['1', '2'],
+        ]
+        parker, batch = xmljson.Parker(), xmljson.Parker(batch=True)
+        for row in rows:
+            xml = '<s><r>%s</r><r><w>1</w></r></s>' % ''.join('<v>%s</v>' % text for text in row)
+            root = fromstring(xml.encode('utf-8'))
+            # Compare JSON, since 1 == 1.0
+            self.assertEqual(json.dumps(batch.data(root)), json.dumps(parker.data(root)))
+            self.assertEqual(json.dumps(batch.data(root[0])), json.dumps(parker.data(root[0])))
+        # Rows with non-leaves, and empty elements, are converted value by value
+        for xml in ['<s><v>1</v><v><x>2</x></v><v>3</v><v>4</v></s>',
+                    '<s><v>1</v><v/><v>3</v><v>4</v></s>']:
+            self.assertEqual(json.dumps(batch.data(fromstring(xml))),
+                             json.dumps(parker.data(fromstring(xml))))
+        # Only Parker with the default xml_fromstring uses it
+        for dialect in [xmljson.Parker(batch=True, xml_fromstring=False),
+                        xmljson.BadgerFish(batch=True)]:
+            self.assertFalse(dialect._batch)
+        self.assertEqual(pickle.loads(pickle.dumps(batch))._batch, True)
+
+
+class TestTraversal(unittest.TestCase):
+    def nested(self, depth, leaf, wrap):
+        'Returns leaf wrapped depth times with wrap(), without recursion'
+        for level in range(depth):
+            leaf = wrap(leaf)
+        return leaf
+
+    def assertDeepEqual(self, first, second):
+        'Compares deeply nested structures without recursion'
+        stack = [(first, second)]
+        while stack:
+            first, second = stack.pop()
+            self.assertEqual(type(first), type(second))
+            if isinstance(first, dict):
+                self.assertEqual(list(first.keys()), list(second.keys()))
+                stack.extend(zip(first.values(), second.values()))
+            elif isinstance(first, list):
+                self.assertEqual(len(first), len(second))
+                stack.extend(zip(first, second))
+            else:
+                self.assertEqual(first, second)
+
+    def test_deep(self):
+        'data() converts documents deeper than the recursion limit'
+        cobra_wrap = (lambda v: Dict([('a', Dict([('attributes', Dict()), ('children', [v])]))]))
+        cases = [
+            (xmljson.badgerfish, Dict([('a', Dict([('$', 1)]))]), lambda v: Dict([('a', v)])),
+            (xmljson.gdata, Dict([('a', Dict([('$t', 1)]))]), lambda v: Dict([('a', v)])),
+            (xmljson.yahoo, Dict([('a', '1')]), lambda v: Dict([('a', v)])),
+            (xmljson.parker, 1, lambda v: Dict([('a', v)])),
+            (xmljson.abdera, Dict([('a', 1)]), lambda v: Dict([('a', v)])),
+            (xmljson.cobra, Dict([('a', '1')]), cobra_wrap),
+        ]
+        for depth in [10, 5000]:
+            root = elem = lxml.etree.Element('a')
+            for level in range(depth):
+                elem = lxml.etree.SubElement(elem, 'a')
+            elem.text = '1'
+            for dialect, leaf, wrap in cases:
+                self.assertDeepEqual(dialect.data(root), self.nested(depth, leaf, wrap))
+
+
+def reference_fromstring(value):
+    'XMLData._fromstring() before the fast path was added'
+    if value is None:
+        return None
+    if value.lower() == 'true':
+        return True
+    elif value.lower() == 'false':
+        return False
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        if float('-inf') < float(value) < float('inf'):
+            return float(value)
+    except ValueError:
+        pass
+    return value
+
+
+class TestFromString(unittest.TestCase):
+    values = [
+        None, '', ' ', 'true', 'TRUE', 'True', ' true', 'false', 'FaLsE', 'truee', 'tru',
+        '0', '1', '-1', '+1', '01', '-007', ' 1', '1 ', '\n1\t', '1_000', '123456789012345678901',
+        '1.5', '-1.5', '+.5', '.5', '5.', '1e5', '1E-5', '-1.5e+10', '1e999', '-1e999',
+        ' 1.5', '1_0.5', 'inf', '-inf', 'Infinity', 'nan', 'NaN', '-nan',
+        u'\u0661\u0662', u'\u0661.\u0665', u'\uff11', u'\u00b2',
+        'abc', 'active', 'USD', '1a', 'a1', '0x10', '1.2.3', 'e5', '1e', '.', '+', '-', '--1',
+        '1.5.', '1e5.5', '..5', '1 2', '+-1', '1' * 4301, '-' + '9' * 5000,
+    ]
+
+    def test_fromstring(self):
+        'Fast _fromstring() matches the original implementation'
+        for value in self.values:
+            expected = reference_fromstring(value)
+            for conv in [xmljson.badgerfish, xmljson.BadgerFish(fromstring_cache=4)]:
+                for repeat in range(2):
+                    result = conv._fromstring(value)
+                    self.assertEqual((type(result), result), (type(expected), expected),
+                                     'Mismatch for %r' % value)
+
+    def test_long_digits(self):
+        'Values with more digits than int() accepts stay strings'
+        value = '1' * 4301
+        self.assertEqual(xmljson.badgerfish.data(fromstring('<a id="%s"/>' % value)),
+                         Dict([('a', Dict([('@id', value)]))]))
+
+    def test_fromstring_cache(self):
+        'fromstring_cache caches custom conversions too'
+        calls = []
+
+        def convert(value):
+            calls.append(value)
+            return value.upper()
+
+        conv = xmljson.BadgerFish(xml_fromstring=convert, fromstring_cache=2)
+        self.assertEqual(conv.data(fromstring('<x a="usd" b="usd"><y>usd</y><z>eur</z></x>')),
+                         Dict([('x', Dict([('@a', 'USD'), ('@b', 'USD'),
+                                           ('y', Dict([('$', 'USD')])),
+                                           ('z', Dict([('$', 'EUR')]))]))]))
+        self.assertEqual(calls, ['usd', 'eur'])
+
+
+class TestToJson(unittest.TestCase):
+    docs = [
+        '<a x="1"><b>2</b><b>3.5</b><c/><!-- comment --><d y="no">t<e/></d><?pi x?></a>',
+        '<a><b>x</b><c>1e999</c><b>NaN</b><c>-0.0</c>tail<b/></a>',
+        u'<a xmlns:n="urn:n" n:x="\u00e9"><n:b>\u2603 "q" \\ \n</n:b><b>true</b></a>',
+        '<a><b><c><d>1</d></c></b><b><c>2</c></b><e/><b/></a>',
+        '<a>  </a>',
+    ]
+
+    def check(self, dialect, doc, **kwargs):
+        doc = doc.encode('utf-8')
+        out = io.StringIO()
+        dialect.to_json(io.BytesIO(doc), out, **kwargs)
+        self.assertEqual(out.getvalue(), json.dumps(dialect.data(fromstring(doc), **kwargs)))
+
+    def test_to_json(self):
+        'to_json() writes exactly json.dumps(data())'
+        for dialect in TestIterData.dialects + [xmljson.BadgerFish(types={'b': str})]:
+            for doc in self.docs:
+                self.check(dialect, doc)
+            for path in ['abdera-1.xml', 'abdera-2.xml', 'abdera-3.xml', 'abdera-4.xml']:
+                self.check(dialect, read(path))
+        for doc in self.docs:
+            self.check(xmljson.parker, doc, preserve_root=True)
+
+    def test_encoder(self):
+        'encoder.iterencode() matches json.dumps()'
+        encode = xmljson.encoder.encode
+        for value in [None, True, False, 0, -1, 10 ** 30, 1.5, float('nan'), float('inf'),
+                      -float('inf'), u'\u00e9\n"', [], {}, (1, 2), [1, [2, {}]],
+                      Dict([('b', 1), ('a', [None])]), {1: 1, 1.5: 2, False: 3, None: 4}]:
+            self.assertEqual(encode(value), json.dumps(value))
+        raw = xmljson.encoder.Raw('{"x": 1}')
+        self.assertEqual(encode({'a': [raw, raw]}), '{"a": [{"x": 1}, {"x": 1}]}')
+        with self.assertRaises(TypeError):
+            encode(object())
+
+
+class TestToXml(unittest.TestCase):
+    docs = [
+        '<a x="1"><b>1</b><b>2.5</b><c y="z">t &amp; "q"</c><d><e/></d></a>',
+        u'<root><alice>\u00e9</alice><bob x="2">t<c/></bob><e><f>true</f></e></root>',
+    ]
+
+    def check(self, dialect, data, root=None):
+        'to_xml() writes the same XML as etree()'
+        elems = dialect.etree(data) if root is None else [
+            dialect.etree(data, root=lxml.etree.Element(root))]
+        expected = b''.join(tostring(elem, encoding='utf-8').split(b'\n', 1)[-1]
+                            for elem in elems)
+        out = io.BytesIO()
+        dialect.to_xml(io.BytesIO(json.dumps(data).encode('utf-8')), out, root=root)
+        self.assertEqual(out.getvalue().split(b'\n', 1)[-1], expected)
+
+    def test_to_xml(self):
+        for dialect in TestIterData.dialects:
+            for doc in self.docs:
+                data = dialect.data(fromstring(doc))
+                self.check(dialect, data, root='wrap')
+                if not isinstance(dialect, xmljson.Parker):
+                    self.check(dialect, data)
+
+    def test_cobra_children(self):
+        'Cobra accepts a single child without a list, the same way in every path'
+        cobra = xmljson.Cobra()
+        for children, expected in [
+                ({'b': 'x'}, b'<a><b>x</b></a>'), ('text', b'<a>text</a>'), (1, b'<a>1</a>'),
+                (None, b'<a></a>'), (['y', {'b': 'x'}], b'<a>y<b>x</b></a>'),
+                ({'b': {'children': 'x'}}, b'<a><b>x</b></a>')]:
+            data = Dict([('a', Dict([('attributes', {}), ('children', children)]))])
+            self.check(cobra, data)
+            self.check(cobra, data, root='wrap')
+            self.assertEqual(tostring(cobra.etree(data)[0]), expected)
+            self.assertEqual(cobra.to_xml_bytes(data), tostring(cobra.etree(data)[0]))
+
+    def test_documents(self):
+        'A top-level array writes each item. root= wraps them in one element'
+        out = io.BytesIO()
+        xmljson.badgerfish.to_xml(io.StringIO(u'[{"a": {"$": 1}}, {"b": {}}]'), out, root='r')
+        self.assertEqual(out.getvalue().split(b'\n', 1)[-1], b'<r><a>1</a><b/></r>')
+        # Parker without root writes multiple top-level elements: not a valid document
+        with self.assertRaises(lxml.etree.LxmlSyntaxError):
+            xmljson.parker.to_xml(io.StringIO(u'{"a": 1, "b": 2}'), io.BytesIO())
+
+    def test_order(self):
+        'Attributes and text must come before child elements'
+        with self.assertRaises(ValueError):
+            xmljson.badgerfish.to_xml(io.StringIO(u'{"a": {"b": {}, "@x": 1}}'), io.BytesIO())
+        with self.assertRaises(ValueError):
+            xmljson.badgerfish.to_xml(io.StringIO(u'{"a": {"@x": {"$": 1}}}'), io.BytesIO())
+
+    def test_invalid_tags(self):
+        conv = xmljson.BadgerFish(invalid_tags='drop')
+        out = io.BytesIO()
+        conv.to_xml(io.StringIO(u'{"a": {"1": {"b": [1, 2]}, "c": {"@x": 1}}}'), out)
+        self.assertEqual(out.getvalue().split(b'\n', 1)[-1], b'<a><c x="1"/></a>')
+
+    def test_decoder(self):
+        'decoder.iterevents() reads the same values as json.loads(), in small chunks too'
+        texts = [u'{"a": [1, -2.5e3, "x\\"\\u00e9", true, false, null, {}, []], "b": NaN}',
+                 u' [ 12345678901234567890 , "' + u'y' * 100 + u'" ] ', u'"\u2603"', u'-0']
+        for text in texts:
+            for size in [1, 3, 65536]:
+                for source in [io.StringIO(text), io.BytesIO(text.encode('utf-8'))]:
+                    events = xmljson.decoder.iterevents(source, size=size)
+                    value = xmljson.decoder.value(next(events), events)
+                    self.assertEqual(json.dumps(value), json.dumps(json.loads(text)))
+                    self.assertEqual(list(events), [])
+        for text in [u'{"a" 1}', u'[1,]', u'{"a": 1', u'[1] 2', u'tru', u'{1: 2}']:
+            with self.assertRaises(ValueError):
+                list(xmljson.decoder.iterevents(io.StringIO(text), size=2))
+
+
+class TestXmlBytes(unittest.TestCase):
+    data = [
+        Dict([('a', Dict([('@x', u'q"\n<&>'), ('$', u'caf\u00e9 & <b>\r'), ('c', Dict()),
+                          ('b', [1, None, True, Dict(), [1, 2]]), ('@y', 2), ('@x', 3)]))]),
+        Dict([('a', Dict([('c', 2), ('@d', 'late'), ('$', 'late text'), ('1', 'x')]))]),
+        Dict([('a', Dict([('attributes', Dict([('x', 1)])),
+                          ('children', ['t1', Dict([('b', 'x')]), 't2'])]))]),
+        Dict([('{urn:x}a', Dict([('b', 1)]))]),
+        Dict([('a', 'x'), ('b', [])]), 'scalar', 1,
+    ]
+
+    def expected(self, dialect, data, root=None):
+        'Return tostring() of etree(), or the error it raises'
+        try:
+            if root is None:
+                return b''.join(tostring(elem, encoding='utf-8') for elem in dialect.etree(data))
+            return tostring(dialect.etree(data, root=lxml.etree.Element(root)), encoding='utf-8')
+        except ValueError as error:
+            return str(error)
+
+    def actual(self, dialect, data, root=None):
+        try:
+            return dialect.to_xml_bytes(data, root)
+        except ValueError as error:
+            return str(error)
+
+    def test_to_xml_bytes(self):
+        'to_xml_bytes() returns tostring() of etree() for every dialect'
+        for cls in [xmljson.Abdera, xmljson.BadgerFish, xmljson.Cobra, xmljson.GData,
+                    xmljson.Parker, xmljson.Yahoo]:
+            dialect = cls(invalid_tags='drop')
+            for data in self.data + [dialect.data(fromstring(doc)) for doc in TestToXml.docs]:
+                for root in [None, 'root']:
+                    self.assertEqual(self.actual(dialect, data, root),
+                                     self.expected(dialect, data, root))
+        out = io.BytesIO()
+        xmljson.badgerfish.write_xml(Dict([('p', 'Hello')]), out, root='html')
+        self.assertEqual(out.getvalue(), b'<html><p>Hello</p></html>')
+
+    def test_errors(self):
+        'to_xml_bytes() raises the same errors as etree()'
+        for data in [{'a b': 1}, {'a': {'@b c': 1}}, {'a': '\x00'}, {'a': {'@b': {'$': 1}}}]:
+            with self.assertRaises(ValueError):
+                xmljson.badgerfish.etree(data)
+            with self.assertRaises(ValueError):
+                xmljson.badgerfish.to_xml_bytes(data)
+        self.assertEqual(xmljson.BadgerFish(invalid_tags='drop').to_xml_bytes({'a b': 1}), b'')
+
+
+class _Converter(xmljson.BadgerFish):
+    '''A subclass with state of its own, for pickling'''
+    def __init__(self, suffix, **kwargs):
+        self.early = suffix
+        super(_Converter, self).__init__(**kwargs)
+        self.suffix = suffix
+
+
+class TestDataMany(unittest.TestCase):
+    docs = [('<a x="%d"><b>%d</b><b>x</b><c/></a>' % (i, i)).encode('utf-8') for i in range(50)]
+
+    def test_data_many(self):
+        'data_many() returns the same as .data() for each document'
+        for dialect in TestIterData.dialects:
+            expected = [dialect.data(fromstring(doc)) for doc in self.docs]
+            self.assertEqual(list(dialect.data_many(self.docs, workers=2, chunksize=3)),
+                             expected)
+            result = dialect.data_many(iter(self.docs), workers=2, chunksize=4, ordered=False)
+            self.assertEqual(sorted(json.dumps(data) for data in result),
+                             sorted(json.dumps(data) for data in expected))
+        result = xmljson.parker.data_many(self.docs[:2], workers=1, preserve_root=True)
+        self.assertEqual(list(result), [xmljson.parker.data(fromstring(doc), preserve_root=True)
+                                        for doc in self.docs[:2]])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs the fork start method')
+    def test_hooks(self):
+        'data_many(start_method="fork") uses dialect hooks, e.g. a lambda for xml_fromstring'
+        dialect = xmljson.BadgerFish(xml_fromstring=lambda v: v + '!', dict_type=dict)
+        result = list(dialect.data_many(self.docs[:1], workers=1, start_method='fork'))
+        self.assertEqual(result, [{'a': {'@x': '0!', 'b': [{'$': '0!'}, {'$': 'x!'}], 'c': {}}}])
+        # Other start methods need to pickle the dialect
+        with self.assertRaises((pickle.PicklingError, AttributeError, TypeError)):
+            list(dialect.data_many(self.docs[:1], workers=1, start_method='spawn'))
+
+    def test_spawn(self):
+        'data_many() pickles the dialect for workers that are not forked'
+        dialect = xmljson.GData(fromstring_cache=10)
+        result = dialect.data_many(self.docs[:4], workers=1, start_method='spawn')
+        self.assertEqual(list(result), [dialect.data(fromstring(doc)) for doc in self.docs[:4]])
+
+    def test_pickle(self):
+        'Dialects pickle, including caches, schemas and wrapped functions'
+        import pickle
+        dialects = [xmljson.Yahoo(), xmljson.BadgerFish(fromstring_cache=10),
+                    xmljson.Parker(dict_type=dict),
+                    xmljson.GData(types={'b': str, '@x': float}, invalid_tags='drop')]
+        for dialect in dialects:
+            copy = pickle.loads(pickle.dumps(dialect))
+            self.assertEqual(type(copy), type(dialect))
+            for doc in self.docs[:3]:
+                self.assertEqual(copy.data(fromstring(doc)), dialect.data(fromstring(doc)))
+            self.assertEqual(tostring(copy.etree({'a': {'b': [1, 2]}})[0]),
+                             tostring(dialect.etree({'a': {'b': [1, 2]}})[0]))
+        self.assertEqual(copy.etree({'1': {}}), [])
+        # Attributes that a subclass sets are kept
+        copy = pickle.loads(pickle.dumps(_Converter('!', dict_type=dict)))
+        self.assertEqual((type(copy), copy.early, copy.suffix), (_Converter, '!', '!'))
+        self.assertEqual(copy.data(fromstring(self.docs[0])), {'a': {
+            '@x': 0, 'b': [{'$': 0}, {'$': 'x'}], 'c': {}}})
+
+
+class TestStats(unittest.TestCase):
+    xml = '<a x="1" y="z"><b>2.5</b><b>true</b><c>hi<d/></c>  <e/></a>'
+
+    def test_overlap(self):
+        'stats() blocks on one dialect cannot overlap, and leave it unwrapped'
+        dialect = xmljson.BadgerFish()
+        first = dialect.stats()
+        first.__enter__()
+        with self.assertRaises(RuntimeError):
+            dialect.stats().__enter__()
+        first.__exit__(None, None, None)
+        self.assertEqual(set(dialect.__dict__) & set(['data', '_build', '_fromstring']), set())
+        with dialect.stats() as result:
+            dialect.data(fromstring(self.xml))
+        self.assertEqual(result.nodes, 6)
+
+    def test_stats(self):
+        'stats() counts nodes and values, and times phases, only in the with block'
+        root = fromstring(self.xml)
+        for dialect in TestIterData.dialects:
+            expected, attrs = dialect.data(root), dict(vars(dialect))
+            with dialect.stats() as result:
+                self.assertEqual(dialect.data(root), expected)
+            self.assertEqual((result.nodes, result.attributes, result.texts), (6, 2, 3))
+            self.assertEqual(list(result.times), ['parse', 'data', 'fromstring', 'serialize'])
+            self.assertGreater(result.times['data'], 0)
+            self.assertEqual(result.times['parse'], 0)
+            self.assertEqual(vars(dialect), attrs)
+        with xmljson.badgerfish.stats() as result:
+            list(xmljson.badgerfish.iterdata(io.BytesIO(self.xml.encode('utf-8')), 'b'))
+            with result.time('parse'):
+                pass
+        self.assertEqual(dict(result.values), {'float': 1, 'bool': 1})
+        self.assertGreater(result.times['parse'], 0)
+        self.assertEqual(result.as_dict()['nodes'], 2)
+
+    def test_restore(self):
+        'stats() restores a custom xml_fromstring'
+        dialect = xmljson.GData(xml_fromstring=len)
+        with dialect.stats() as result:
+            self.assertEqual(dialect.data(fromstring('<a>xyz</a>')), {'a': {'$t': 3}})
+        self.assertEqual(dict(result.values), {'int': 1})
+        self.assertIs(dialect._fromstring, len)
+
+    def test_cli(self):
+        'CLI --stats prints counts and times to stderr'
+        path = os.path.join(_folder, 'abdera-3.xml')
+        self.assertTrue(parse_options(['--stats', path])[3]['stats'])
+        stderr, sys.stderr = sys.stderr, io.StringIO()
+        try:
+            for options in [{'stats': True}, {'stats': True, 'stream': True,
+                                              'record_tag': 'root/*'}]:
+                main(io.open(path, 'rb'), io.StringIO(), xmljson.BadgerFish(), **options)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(output.count('nodes: '), 2)
+        self.assertIn('parse ', output)
+        self.assertIn('serialize ', output)
+
+
+class TestOutput(unittest.TestCase):
+    value = Dict([('a', [1, 2.5, True, None, (3, )]), ('b', u'\xe9<"/\n'), ('c', Dict())])
+
+    def test_dumper(self):
+        'Dumper() writes the same JSON as json.dumps() with every library'
+        libraries = []
+        for library in xmljson.output.libraries:
+            for indent, ensure_ascii in itertools.product([None, 2, 4], [True, False]):
+                try:
+                    dumper = xmljson.output.Dumper(indent, library, ensure_ascii)
+                except (ImportError, ValueError):
+                    continue
+                libraries.append(library)
+                for value in [self.value, {'a': [1, 'b']}]:
+                    self.assertEqual(dumper.dumps(value).decode('utf-8'), json.dumps(
+                        value, indent=indent, ensure_ascii=ensure_ascii,
+                        separators=(',', ':' if indent is None else ': ')))
+        self.assertIn('json', libraries)
+        dumper = xmljson.output.Dumper()
+        self.assertIn(dumper.library, libraries)
+        # Values the library rejects are encoded by json
+        self.assertEqual(dumper.dumps({'a': 2 ** 70}), b'{"a":1180591620717411303424}')
+        with self.assertRaises(TypeError):
+            dumper.dumps({'a': object()})
+
+    def test_output(self):
+        'Output() writes bytes in large pieces to binary and text files'
+        text = xmljson.output.Dumper().dumps(self.value)
+        for out in [io.BytesIO(), io.StringIO(), io.TextIOWrapper(io.BytesIO(), 'utf-8')]:
+            output = xmljson.output.Output(out, size=20)
+            for index in range(3):
+                output.write(text)
+            output.flush()
+            result = getattr(out, 'buffer', out).getvalue()
+            self.assertEqual(result, text * 3 if isinstance(result, bytes) else
+                             text.decode('utf-8') * 3)
+
+
+class TestView(unittest.TestCase):
+    xml = ('<a x="1"><b>1</b><b>2<c/></b>hi<d y="2"><e>t</e>x</d><f/>'
+           '<g><h/><h>1</h></g><i><j><k>3</k></j></i></a>')
+
+    def test_view(self):
+        'view() has the same keys and values as data()'
+        docs = [self.xml] + [read(path) for path in [
+            'abdera-1.xml', 'abdera-2.xml', 'abdera-3.xml', 'abdera-4.xml']]
+        for dialect in TestIterData.dialects + [xmljson.BadgerFish(types={'/a/i/j/k': str})]:
+            for doc in docs:
+                root = fromstring(doc)
+                expected = dialect.data(root)
+                view = dialect.view(root)
+                self.assertEqual(view, expected)
+                self.assertEqual(expected, view)
+                self.assertEqual(json.dumps(view), json.dumps(expected))
+                self.assertEqual(json.dumps(dict(dialect.view(root))), json.dumps(dict(expected)))
+        parker = xmljson.parker
+        self.assertEqual(parker.view(fromstring(self.xml), preserve_root=True),
+                         parker.data(fromstring(self.xml), preserve_root=True))
+
+    def test_lazy(self):
+        'view() converts only what is read, and caches it'
+        root = fromstring(self.xml)
+        dialect = xmljson.BadgerFish()
+        with dialect.stats() as result:
+            view = dialect.view(root)['a']
+            self.assertEqual(result.nodes, 1)
+            self.assertEqual(view['i']['j']['k'], {'$': 3})
+            self.assertEqual(result.nodes, 4)
+            self.assertIs(view['i'], view['i'])
+            self.assertEqual(view['b'], [{'$': 1}, {'$': 2, 'c': {}}])
+            self.assertEqual(result.nodes, 7)
+
+    def test_read_only(self):
+        'view() cannot be changed. Copies and pickles are plain OrderedDicts'
+        import pickle
+        view = xmljson.badgerfish.view(fromstring(self.xml))
+        for change in [lambda: view.update({}), lambda: view.pop('a'), view.clear,
+                       lambda: view.__setitem__('x', 1), lambda: view.setdefault('x')]:
+            with self.assertRaises(TypeError):
+                change()
+        expected = xmljson.badgerfish.data(fromstring(self.xml))
+        for copy in [view.copy(), pickle.loads(pickle.dumps(view))]:
+            self.assertEqual(type(copy), Dict)
+            self.assertEqual(copy, expected)
+
+
+class TestFilters(unittest.TestCase):
+    xml = (b'<doc><head><id>1</id><blob>QUJD</blob></head>'
+           b'<item n="1"><title>A</title><blob><x>1</x></blob><audit><by>me</by></audit></item>'
+           b'<item n="2"><title>B</title><tags><tag>t</tag></tags></item>'
+           b'<audit><item><title>C</title></item></audit></doc>')
+    filters = [
+        (None, ['blob']), (None, ['item/blob', '/doc/audit']), (['title'], None),
+        (['item/title', 'id'], ['audit']), (['/doc/item'], ['blob']), (['nothing'], None),
+        (['tags/*'], []),
+    ]
+
+    def prune(self, elem, tags, include, exclude, inside):
+        'Remove excluded and not included elements under elem. Return True if any is included'
+        def match(paths, tags):
+            return any(xmljson.paths.matcher(path)(tags) for path in paths or ())
+
+        found = False
+        for child in list(elem):
+            child_tags = tags + [child.tag]
+            if match(exclude, child_tags):
+                elem.remove(child)
+                continue
+            included = inside or include is None or match(include, child_tags)
+            if self.prune(child, child_tags, include, exclude, included) or included:
+                found = True
+            else:
+                elem.remove(child)
+        return found
+
+    def expected(self, include, exclude, tag=None):
+        root = fromstring(self.xml)
+        self.prune(root, [root.tag], include, exclude, include is None)
+        return root if tag is None else list(root.iter(tag))
+
+    def test_data(self):
+        'data(include=, exclude=) converts the same as data() on a pruned tree'
+        for dialect in TestIterData.dialects:
+            for include, exclude in self.filters:
+                root = fromstring(self.xml)
+                self.assertEqual(dialect.data(root, include=include, exclude=exclude),
+                                 dialect.data(self.expected(include, exclude)))
+                self.assertEqual(tostring(root), self.xml)
+        # Paths start from the document root, even when converting a child
+        item = fromstring(self.xml)[1]
+        self.assertEqual(xmljson.parker.data(item, exclude=['/doc/item/blob', 'audit']),
+                         Dict([('title', 'A')]))
+
+    def test_stream(self):
+        'to_json() and iterdata() apply filters while parsing'
+        for dialect in TestIterData.dialects:
+            for include, exclude in self.filters:
+                out = io.StringIO()
+                dialect.to_json(io.BytesIO(self.xml), out, include=include, exclude=exclude)
+                self.assertEqual(out.getvalue(),
+                                 json.dumps(dialect.data(self.expected(include, exclude))))
+                records = dialect.iterdata(io.BytesIO(self.xml), 'item', include, exclude)
+                self.assertEqual(list(records), [
+                    dialect.data(elem) for elem in self.expected(include, exclude, 'item')])
+
+    def test_events(self):
+        'Skipped elements are cleared as soon as they end'
+        events = lxml.etree.iterparse(io.BytesIO(self.xml), events=('start', 'end'))
+        kept = list(xmljson._filter_events(events, include=['title'], exclude=['blob']))
+        tags = set(elem.tag for event, elem in kept)
+        self.assertEqual(tags, set(['doc', 'item', 'title', 'audit']))
+        root = kept[0][1]
+        for tag in ['blob', 'head', 'tags']:
+            for elem in root.iter(tag):
+                self.assertEqual((len(elem), elem.text), (0, None))
+
+    def test_ancestors(self):
+        'Paths that match the ancestors of a record apply to all of it'
+        xml = b'<rss><channel><item><title>T</title><link>L</link></item></channel></rss>'
+        bf = xmljson.badgerfish
+        item = bf.data(fromstring(xml))['rss']['channel']
+        elem = fromstring(xml).find('channel/item')
+        for include in [['channel'], ['/rss'], ['item']]:
+            self.assertEqual(list(bf.iterdata(io.BytesIO(xml), 'item', include)), [item])
+            self.assertEqual(bf.data(elem, include=include), item)
+            self.assertEqual(list(bf.columns(io.BytesIO(xml), 'item', include=include)),
+                             ['title/$', 'link/$'])
+        self.assertEqual(bf.data(elem, include=['link']), {'item': {'link': {'$': 'L'}}})
+        self.assertEqual(bf.data(elem, exclude=['channel']), {'item': {}})
+        self.assertEqual(list(bf.iterdata(io.BytesIO(xml), 'item', exclude=['channel'])), [])
+        # The document root is never excluded
+        self.assertEqual(bf.data(elem, exclude=['rss']), item)
+        self.assertEqual(list(bf.iterdata(io.BytesIO(xml), 'item', exclude=['rss'])), [item])
+
+    def test_cli(self):
+        'CLI --include and --exclude'
+        path = os.path.join(_folder, 'abdera-1.xml')
+        options = parse_options(['--include', 'Services', '--exclude', 'Fuel', path])[3]
+        self.assertEqual((options['include'], options['exclude']), (['Services'], ['Fuel']))
+        for extra in [{}, {'stream': True, 'record_tag': 'Airport'}]:
+            main(io.open(path, 'rb'), openwrite(TestCLI.tmp), xmljson.Parker(),
+                 include=['Runway'], exclude=['Fuel'], **extra)
+            with io.open(TestCLI.tmp, encoding='utf-8') as handle:
+                output = handle.read()
+            self.assertIn('Runway', output)
+            self.assertNotIn('Services', output)
+        os.remove(TestCLI.tmp)
+
+
+class TestCompact(unittest.TestCase):
+    xml = ('<root>' + '<item id="1" type="x"><name>a</name><tag>b</tag><tag>c</tag></item>' * 3 +
+           '</root>')
+
+    def test_compact(self):
+        'compact=True returns plain dicts with the same data'
+        root = fromstring(self.xml)
+        for cls in [xmljson.Abdera, xmljson.BadgerFish, xmljson.Cobra, xmljson.GData,
+                    xmljson.Parker, xmljson.Yahoo]:
+            data = cls(compact=True).data(root)
+            self.assertIs(type(data), dict)
+            self.assertEqual(json.dumps(data), json.dumps(cls().data(root)))
+        self.assertIs(xmljson.BadgerFish(compact=True, dict_type=Dict).dict, Dict)
+
+    def test_keys(self):
+        'Elements share one string for each tag and attribute key'
+        items = xmljson.BadgerFish().data(fromstring(self.xml))['root']['item']
+        first, second = [list(item) for item in items[:2]]
+        for key1, key2 in zip(first, second):
+            self.assertIs(key1, key2)
+        self.assertEqual(first, ['@id', '@type', 'name', 'tag'])
+
+    def test_names(self):
+        'Key caches are bounded'
+        names = xmljson._Names('@')
+        names.size = 2
+        self.assertEqual([names[key] for key in 'abcd'], ['@a', '@b', '@c', '@d'])
+        self.assertEqual(len(names), 2)
+
+    def test_shapes(self):
+        'Records with the same layout share a plan of which children are lists'
+        converter = xmljson.BadgerFish()
+        converter.data(fromstring(self.xml))
+        self.assertEqual(dict(converter._shapes), {
+            ('name', 'tag', 'tag'): (False, True, True),
+            ('item', 'item', 'item'): (True, True, True),
+        })
+        shapes = xmljson._Shapes()
+        shapes.children = 2
+        self.assertEqual(shapes.repeated(fromstring('<a><b/><c/><b/></a>')), (True, False, True))
+        self.assertEqual(len(shapes), 0)
+
+
+class TestShared(unittest.TestCase):
+    xml = ('<root>' + '<item id="1"><addr><city>X</city></addr><c>1</c><c>1.0</c></item>' * 3 +
+           '<item id="2"><addr><city>X</city></addr></item></root>')
+
+    def test_shared(self):
+        'shared=True returns the same data, with one object for identical subtrees'
+        root = fromstring(self.xml)
+        for cls in [xmljson.Abdera, xmljson.BadgerFish, xmljson.Cobra, xmljson.GData,
+                    xmljson.Parker, xmljson.Yahoo]:
+            data, plain = cls(shared=True).data(root), cls().data(root)
+            self.assertIsInstance(data, xmljson.FrozenOrderedDict)
+            self.assertEqual(json.dumps(data), json.dumps(plain))
+            self.assertEqual([tostring(e) for e in cls().etree(data)],
+                             [tostring(e) for e in cls().etree(plain)])
+        items = xmljson.BadgerFish(shared=True).data(root)['root']['item']
+        self.assertIsInstance(items, tuple)
+        self.assertIs(items[0], items[2])
+        self.assertIsNot(items[0], items[3])
+        self.assertIs(items[0]['addr'], items[3]['addr'])
+        # 1 and 1.0 are equal, but are not shared
+        self.assertEqual([type(c['$']) for c in items[0]['c']], [int, float])
+        data = xmljson.Parker(shared=True, compact=True).data(root, preserve_root=True)
+        self.assertIsInstance(data, xmljson.FrozenDict)
+        # 0.0 and -0.0 are equal, but are not shared either
+        data = xmljson.BadgerFish(shared=True).data(fromstring('<a><b>0.0</b><b>-0.0</b></a>'))
+        self.assertEqual([repr(b['$']) for b in data['a']['b']], ['0.0', '-0.0'])
+
+    def test_frozen(self):
+        'Shared data cannot be changed, but can be copied, hashed and pickled'
+        import pickle
+        data = xmljson.BadgerFish(shared=True).data(fromstring(self.xml))
+        item = data['root']['item'][0]
+        for change in [lambda: item.update(x=1), lambda: item.pop('addr'), item.clear]:
+            self.assertRaises(TypeError, change)
+        with self.assertRaises(TypeError):
+            item['x'] = 1
+        copy = item.copy()
+        copy['x'] = 1
+        self.assertEqual(len(copy), len(item) + 1)
+        self.assertEqual(hash(item), hash(data['root']['item'][1]))
+        self.assertEqual(pickle.loads(pickle.dumps(data)), data)
+        self.assertIsInstance(pickle.loads(pickle.dumps(data)), xmljson.FrozenOrderedDict)
+
+
+class TestTypes(unittest.TestCase):
+    xml = '''<order id="007" paid="1"><zip>01234</zip><total>12</total>
+        <item sku="0042"><qty>3</qty><price currency="USD">9.50</price></item></order>'''
+
+    xsd = b'''<?xml version="1.0"?>
+    <xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+      <xs:simpleType name="Zip">
+        <xs:restriction base="xs:string"><xs:pattern value="[0-9]{5}"/></xs:restriction>
+      </xs:simpleType>
+      <xs:complexType name="Price">
+        <xs:simpleContent>
+          <xs:extension base="xs:decimal">
+            <xs:attribute name="currency" type="xs:string"/>
+          </xs:extension>
+        </xs:simpleContent>
+      </xs:complexType>
+      <xs:element name="order">
+        <xs:complexType>
+          <xs:sequence>
+            <xs:element name="zip" type="Zip"/>
+            <xs:element name="total" type="xs:double"/>
+            <xs:element name="item" maxOccurs="unbounded">
+              <xs:complexType>
+                <xs:all>
+                  <xs:element name="qty" type="xs:positiveInteger"/>
+                  <xs:element name="price" type="Price"/>
+                </xs:all>
+                <xs:attribute name="sku" type="xs:token"/>
+              </xs:complexType>
+            </xs:element>
+          </xs:sequence>
+          <xs:attribute name="id" type="xs:string"/>
+          <xs:attribute name="paid" type="xs:boolean"/>
+        </xs:complexType>
+      </xs:element>
+    </xs:schema>'''
+
+    def test_xsd_types(self):
+        'xsd_types() lists the simple types of elements and attributes'
+        self.assertEqual(dict(xmljson.schema.xsd_types(io.BytesIO(self.xsd))), {
+            '/order/zip': 'string', '/order/total': 'double', '/order/item/qty': 'positiveInteger',
+            '/order/item/price': 'decimal', '/order/item/price/@currency': 'string',
+            '/order/item/@sku': 'token', '/order/@id': 'string', '/order/@paid': 'boolean'})
+        # Recursive element refs are expanded once
+        xsd = b'''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+          <xs:element name="node"><xs:complexType><xs:sequence>
+            <xs:element ref="node" minOccurs="0" maxOccurs="unbounded"/>
+          </xs:sequence><xs:attribute name="id" type="xs:int"/></xs:complexType></xs:element>
+        </xs:schema>'''
+        self.assertEqual(dict(xmljson.schema.xsd_types(io.BytesIO(xsd))), {
+            '/node/@id': 'int', '/node/node/@id': 'int'})
+        conv = xmljson.BadgerFish(types=io.BytesIO(xsd))
+        self.assertEqual(conv.data(fromstring('<node id="1"><node id="2"/></node>')),
+                         Dict([('node', Dict([('@id', 1), ('node', Dict([('@id', 2)]))]))]))
+
+    def test_xsd_namespace(self):
+        'Names in the targetNamespace are qualified by their form, like lxml tags'
+        xsd = b'''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:o="http://x/o"
+            targetNamespace="http://x/o" elementFormDefault="qualified">
+          <xs:attribute name="ref" type="xs:string"/>
+          <xs:element name="order"><xs:complexType><xs:sequence>
+            <xs:element name="zip" type="xs:string"/>
+            <xs:element name="note" type="xs:string" form="unqualified"/>
+          </xs:sequence>
+          <xs:attribute name="id" type="xs:string"/>
+          <xs:attribute ref="o:ref"/>
+          </xs:complexType></xs:element>
+        </xs:schema>'''
+        self.assertEqual(dict(xmljson.schema.xsd_types(io.BytesIO(xsd))), {
+            '/{http://x/o}order/{http://x/o}zip': 'string', '/{http://x/o}order/note': 'string',
+            '/{http://x/o}order/@id': 'string', '/{http://x/o}order/@{http://x/o}ref': 'string'})
+        xml = '''<o:order xmlns:o="http://x/o" id="007" o:ref="1"><o:zip>01234</o:zip>
+            <note>2</note></o:order>'''
+        data = xmljson.Parker(types=io.BytesIO(xsd)).data(fromstring(xml), preserve_root=True)
+        self.assertEqual(json.loads(json.dumps(data)), {'{http://x/o}order': {
+            '{http://x/o}zip': '01234', 'note': '2'}})
+        data = xmljson.BadgerFish(types=io.BytesIO(xsd)).data(fromstring(xml))
+        order = data['{http://x/o}order']
+        self.assertEqual((order['@id'], order['@{http://x/o}ref']), ('007', '1'))
+
+    def test_types(self):
+        'types= converts values at declared paths and guesses the rest'
+        expected = {
+            'badgerfish': {'order': {
+                '@id': '007', '@paid': True, 'zip': {'$': '01234'}, 'total': {'$': 12.0},
+                'item': {'@sku': '0042', 'qty': {'$': 3},
+                         'price': {'@currency': 'USD', '$': 9.5}}}},
+            'parker': {'zip': '01234', 'total': 12.0, 'item': {'qty': 3, 'price': 9.5}},
+            'cobra': {'order': {'attributes': {'id': '007', 'paid': True}, 'children': [
+                {'zip': '01234'}, {'total': 12.0, 'item': {
+                    'attributes': {'sku': '0042'}, 'children': [
+                        {'qty': 3}, {'price': {'attributes': {'currency': 'USD'},
+                                               'children': [9.5]}}]}}]}},
+        }
+        xsd = xmljson.schema.Schema.from_xsd(io.BytesIO(self.xsd))
+        types = {'zip': str, '@id': 'string', '/order/@paid': bool, 'total': float,
+                 'order/*/@sku': str, 'item/qty': int, 'price': float}
+        for schema in [types, io.BytesIO(self.xsd), xsd]:
+            for cls in [xmljson.BadgerFish, xmljson.Parker, xmljson.Cobra]:
+                conv = cls(types=schema)
+                self.assertEqual(json.loads(json.dumps(conv.data(fromstring(self.xml)))),
+                                 expected[cls.__name__.lower()])
+        # Untyped values are still guessed. Paths are matched from the document root
+        conv = xmljson.BadgerFish(types={'/order/item/@sku': str})
+        data = conv.data(fromstring(self.xml))['order']
+        self.assertEqual((data['@id'], data['item']['@sku']), (7, '0042'))
+        item = fromstring(self.xml).find('item')
+        self.assertEqual(conv.data(item)['item']['@sku'], '0042')
+        with self.assertRaises(ValueError):
+            xmljson.BadgerFish(types={'zip': int}).data(fromstring('<zip>N/A</zip>'))
+        # * matches tags, not attributes. @* matches attributes
+        item = fromstring('<item id="abc" n="1"><p>1</p></item>')
+        self.assertEqual(xmljson.Parker(types={'item/*': float}).data(item), {'p': 1.0})
+        data = xmljson.BadgerFish(types={'item/*': float, '@*': str}).data(item)
+        self.assertEqual(json.loads(json.dumps(data)), {'item': {
+            '@id': 'abc', '@n': '1', 'p': {'$': 1.0}}})
+
+
 class TestXmlJson(unittest.TestCase):
     def check_etree(self, conv, tostring=tostring, fromstring=fromstring):
         'Returns method(obj, xmlstring) that converts obj to XML and compares'
@@ -500,6 +1752,17 @@ class TestParker(TestXmlJson):
         eq('{"root": {"{http://zanstra.com/ding}dong": "binnen"}}',
            '<root xmlns:ding="http://zanstra.com/ding"><ding:dong>binnen</ding:dong></root>')
 
+    def test_data_with_root_unchanged(self):
+        'preserve_root=True does not change the tree, and paths start from the document root'
+        doc = fromstring('<doc><a><id>01</id><b>2</b></a><c/></doc>')
+        before = tostring(doc)
+        elem = doc[0]
+        parker = xmljson.Parker(types={'/doc/a/id': str})
+        self.assertEqual(parker.data(elem, preserve_root=True),
+                         Dict([('a', Dict([('id', '01'), ('b', 2)]))]))
+        self.assertIs(elem.getparent(), doc)
+        self.assertEqual(tostring(doc), before)
+
     def test_xml_fromstring(self):
         'xml_fromstring=False does not convert types'
         x2j_convert = self.check_data(xmljson.Parker(xml_fromstring=True))
@@ -749,3 +2012,21 @@ class TestCobra(TestXmlJson):
         # Attributes go in specific "attributes" dictionary
         eq('{"alice": {"attributes": {"charlie": "david"}, "children": ["bob"]}}',
             '<alice charlie="david">bob</alice>')
+
+    def test_data_linear(self):
+        'Cobra converts each element once, however deep the document'
+        class CountingCobra(xmljson.Cobra):
+            calls = 0
+
+            def _build(self, *args):
+                self.calls += 1
+                return super(CountingCobra, self)._build(*args)
+
+        # <a><b/><a><b/><a>...</a></a></a> used to take 2^depth conversions
+        root = elem = lxml.etree.Element('a')
+        for level in range(20):
+            lxml.etree.SubElement(elem, 'b')
+            elem = lxml.etree.SubElement(elem, 'a')
+        conv = CountingCobra()
+        conv.data(root)
+        self.assertEqual(conv.calls, sum(1 for node in root.iter()))
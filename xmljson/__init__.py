@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import re
 import sys
-from collections import Counter, OrderedDict
+import pickle
+from array import array
+from collections import Counter, OrderedDict, deque
 try:
-    from lxml.etree import Element
+    from functools import lru_cache
 except ImportError:
-    from xml.etree.cElementTree import Element
+    lru_cache = None
+try:
+    from lxml.etree import Element, fromstring, iterparse, tostring
+except ImportError:
+    from xml.etree.cElementTree import Element, fromstring, iterparse, tostring
+from . import decoder, encoder, paths, serializer, stats
+from .view import Pending, View
+from .shared import FrozenDict, FrozenOrderedDict, Sharer
+from .schema import Schema
 
 __author__ = 'S Anand'
 __email__ = 'root.node@gmail.com'
@@ -17,24 +28,470 @@ if sys.version_info[0] == 3:
     basestring = str
 
 
+# Plain ASCII numbers. If no group matches, it is an int. Else a float
+_number = re.compile(r'[-+]?(?:[0-9]+(\.[0-9]*)?|(\.[0-9]+))([eE][-+]?[0-9]+)?\Z')
+# Any (Unicode) decimal digit. int() and float() need at least one
+_digit = re.compile(r'\d', re.UNICODE)
+# A line without . e or E. float() would accept it, but XMLData._fromstring() would not
+_inexact = re.compile(r'(?m)^[^.eE\n]*$')
+_inf = float('inf')
+# Fewest leaf siblings worth converting in bulk
+_batch_size = 4
+
+
+def _fromstrings(texts):
+    '''Return [XMLData._fromstring(text) for text in texts] if the texts are all ints or all
+    finite floats, converted in bulk with one int() or float() pass. Else None'''
+    if None in texts:
+        return None
+    try:
+        return list(map(int, texts))
+    except ValueError:
+        pass
+    try:
+        values = list(map(float, texts))
+    except ValueError:
+        return None
+    # _fromstring() returns int-like texts as ints, and infinity and NaN as strings
+    if _inexact.search('\n'.join(texts)) is None and -_inf < min(values) and max(values) < _inf:
+        return values
+    return None
+
+
+def _memoize(fn, size):
+    '''Return fn with a cache of its results for up to size distinct arguments'''
+    if lru_cache is not None:
+        return lru_cache(maxsize=size)(fn)
+    cache = {}
+
+    def memoized(value):
+        if value not in cache:
+            if len(cache) >= size:
+                cache.clear()
+            cache[value] = fn(value)
+        return cache[value]
+
+    return memoized
+
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    _intern = intern    # noqa: Python 2
+
+
+class _Names(dict):
+    '''Maps tags or attribute names to interned keys, adding a prefix if any.
+
+    Every element otherwise gets its own copy of each key string (and prefixed attribute names
+    are concatenated each time). Keeps up to 10,000 names, so unusual documents cannot make it
+    grow without bound.
+    '''
+    size = 10000
+
+    def __init__(self, prefix=None):
+        super(_Names, self).__init__()
+        self.prefix = prefix
+
+    def __missing__(self, name):
+        key = unicode(name) if self.prefix is None else self.prefix + name
+        try:
+            key = _intern(key)
+        except TypeError:
+            # Python 2 cannot intern unicode
+            pass
+        if len(self) < self.size:
+            self[name] = key
+        return key
+
+
+class _Shapes(dict):
+    '''Maps a tuple of sibling tags to whether each tag repeats, i.e. becomes a list.
+
+    Records in a feed usually share a few layouts, so this is computed once per layout instead
+    of counting tags for every element. Only layouts of up to 64 children are kept, and up to
+    10,000 of them.
+    '''
+    size, children = 10000, 64
+
+    def repeated(self, children):
+        '''Return a tuple of True / False for each child: does its tag repeat?'''
+        tags = tuple([child.tag for child in children])
+        plan = self.get(tags)
+        if plan is None:
+            count = Counter(tags)
+            plan = tuple([count[tag] > 1 for tag in tags])
+            if len(tags) <= self.children and len(self) < self.size:
+                self[tags] = plan
+        return plan
+
+
+# repeated() for 0 or 1 children: nothing repeats
+_unique = ((), (False, ))
+
+
+def _identity(value):
+    '''Return value as-is. (A module-level function, unlike a lambda, can be pickled)'''
+    return value
+
+
+def _children(node):
+    '''Return the child elements of node, skipping comments and processing instructions'''
+    return [child for child in node if isinstance(child.tag, basestring)]
+
+
+class _Child(object):
+    '''Stands in for a child element that is already converted. build() only needs its tag'''
+    __slots__ = ('tag', )
+
+    def __init__(self, tag):
+        self.tag = tag
+
+
+class _OpenElement(object):
+    '''An element being written to an lxml xmlfile. Its start tag is written when its first
+    child is, so attributes and text are collected until then.'''
+    def __init__(self, xf, tag):
+        self.xf = xf
+        self.tag = tag
+        self.attrib = OrderedDict()
+        self.text = None
+        self.context = None
+
+    def _check(self, what):
+        if self.context is not None:
+            raise ValueError('%s of <%s> must come before its child elements to stream' % (
+                what, self.tag))
+
+    def set(self, key, value):
+        self._check('Attribute %s' % key)
+        self.attrib[key] = value
+
+    def set_text(self, text):
+        self._check('Text')
+        self.text = text
+
+    def open(self):
+        '''Write the start tag and text, if not already written'''
+        if self.context is None:
+            self.context = self.xf.element(self.tag, self.attrib)
+            self.context.__enter__()
+            if self.text:
+                self.xf.write(self.text)
+
+    def close(self):
+        '''Write the end tag. Elements without children are written whole, as <tag/> if empty'''
+        if self.context is None:
+            elem = Element(self.tag, self.attrib)
+            elem.text = self.text
+            self.xf.write(elem)
+        else:
+            self.context.__exit__(None, None, None)
+
+
+def _drop_preceding(parent, elem):
+    '''Remove the (processed) siblings before elem from parent'''
+    if hasattr(elem, 'getprevious'):
+        while elem.getprevious() is not None:
+            del parent[0]
+    else:
+        for index, child in enumerate(parent):
+            if child is elem:
+                del parent[:index]
+                break
+
+
+def _iterrecords(events, path, cleared=None):
+    '''Yield elements matching path from (event, element) pairs, then clear them.
+
+    ``events`` is an iterable of ``('start', element)`` and ``('end', element)`` pairs (e.g.
+    from ``iterparse``). Matched elements are yielded when they end. Once the consumer moves on,
+    they are cleared along with their processed preceding siblings, keeping memory flat. Matches
+    nested inside another match are part of the outer record, not separate records.
+
+    A ``(None, None)`` pair means that no more events are available yet (see xmljson.aio). It
+    yields None, and continues when more events arrive.
+
+    If cleared is a list, (element, parent) pairs are added to it instead of being cleared.
+    The caller clears them later with _clear(cleared).
+    '''
+    match = paths.matcher(path)
+    stack, tags = [], []
+    record = None
+    for event, elem in events:
+        if event is None:
+            yield None
+            continue
+        if event == 'start':
+            stack.append(elem)
+            tags.append(elem.tag)
+            if record is None and match(tags):
+                record = elem
+            continue
+        stack.pop()
+        tags.pop()
+        if elem is record:
+            record = None
+            yield elem
+        # Elements outside a record are never needed again
+        if record is None:
+            if cleared is not None:
+                cleared.append((elem, stack[-1] if stack else None))
+                continue
+            elem.clear()
+            if stack:
+                _drop_preceding(stack[-1], elem)
+
+
+def _clear(cleared):
+    '''Clear the (element, parent) pairs that _iterrecords() added to cleared, and empty it'''
+    for elem, parent in cleared:
+        elem.clear()
+        if parent is not None:
+            _drop_preceding(parent, elem)
+    del cleared[:]
+
+
+def _unpickle(cls, options):
+    '''Re-create a dialect from its constructor options. See XMLData.__reduce__'''
+    self = cls.__new__(cls)
+    XMLData.__init__(self, **options)
+    return self
+
+
+# The state (e.g. the dialect) that data_many() and the command line's --bulk send to worker
+# processes. See _share_state()
+_worker = {}
+
+
+def _share_state(state, method):
+    '''Return state pickled, to send with each task to worker processes started by method.
+
+    Forked workers inherit what cannot be pickled (e.g. a lambda for xml_fromstring) as-is. For
+    them, state is kept in _worker and None is returned. Other methods raise an error.
+    '''
+    try:
+        return pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        if method != 'fork':
+            raise
+    _worker.clear()
+    _worker.update(config=None, state=state)
+    return None
+
+
+def _load_state(config):
+    '''Return the state that _share_state() pickled as config, unpickling it once per process'''
+    if config is not None and _worker.get('config') != config:
+        _worker.clear()
+        _worker.update(config=config, state=pickle.loads(config))
+    return _worker['state']
+
+
+def _data_chunk(config, docs):
+    '''Return .data() for a list of XML documents, in a worker process'''
+    dialect, kwargs = _load_state(config)
+    return [dialect.data(fromstring(doc), **kwargs) for doc in docs]
+
+
+def _chunks(items, size):
+    '''Yield lists of up to size items from an iterable'''
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _next_results(futures, ordered):
+    '''Remove the next (or, if not ordered, any) finished futures and return their results'''
+    if ordered:
+        return futures.popleft().result()
+    from concurrent.futures import wait, FIRST_COMPLETED
+    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+    results = []
+    for future in done:
+        futures.remove(future)
+        results.extend(future.result())
+    return results
+
+
+# States of an element in _filter_events()
+_SKIP, _INSIDE, _HELD, _OPEN = range(4)
+
+
+def _filter_events(events, include=None, exclude=None, tags=(), clear=True):
+    '''Yield the (event, element) pairs of elements that pass include / exclude tag paths.
+
+    exclude drops matching elements and everything in them. include keeps only matching
+    elements, everything in them, and the elements that contain them. (Others are held back
+    until something inside them is included.) tags are the tags above the first element. The
+    first element is included if a path in include matches one of them, and dropped if an
+    element between it and the document root is excluded. Otherwise it is kept. With
+    clear=True, dropped elements are cleared as they end.
+    '''
+    include = [paths.matcher(path) for path in include or ()] or None
+    exclude = [paths.matcher(path) for path in exclude or ()]
+    tags, states, held = list(tags), [], []
+    for event, elem in events:
+        # No more events yet. Pass this on (see _iterrecords)
+        if event is None:
+            yield event, elem
+            continue
+        if event == 'start':
+            tags.append(elem.tag)
+            parent = states[-1] if states else None
+            if parent is None and len(tags) > 1:
+                # The first element is inside (or outside) what its ancestors' paths select.
+                # Like the first element, the document root is never excluded
+                above = [tags[:end] for end in range(1, len(tags))]
+                if any(m(path) for m in exclude for path in above[1:]):
+                    parent = _SKIP
+                elif include is not None and any(m(path) for m in include for path in above):
+                    parent = _INSIDE
+            if parent == _SKIP or (parent is not None and any(m(tags) for m in exclude)):
+                states.append(_SKIP)
+                continue
+            if include is None or parent == _INSIDE or any(m(tags) for m in include):
+                states.append(_INSIDE)
+            elif parent is None:
+                states.append(_OPEN)
+            else:
+                states.append(_HELD)
+                held.append(elem)
+                continue
+            # An element is kept: so are the elements that contain it
+            for ancestor in held:
+                yield 'start', ancestor
+            states[len(states) - len(held) - 1:-1] = [_OPEN] * len(held)
+            del held[:]
+            yield event, elem
+            continue
+        tags.pop()
+        state = states.pop()
+        if state == _HELD:
+            held.pop()
+        if state in (_SKIP, _HELD):
+            if clear:
+                elem.clear()
+            continue
+        yield event, elem
+
+
+def _tree_events(root):
+    '''Yield ('start', element) and ('end', element) for the elements in a tree, like iterparse'''
+    yield 'start', root
+    stack = [(root, iter(_children(root)))]
+    while stack:
+        node, pending = stack[-1]
+        for child in pending:
+            yield 'start', child
+            stack.append((child, iter(_children(child))))
+            break
+        else:
+            stack.pop()
+            yield 'end', node
+
+
+def _parse_events(source, include=None, exclude=None):
+    '''Return iterparse() start and end events for source, filtered by include / exclude'''
+    events = iterparse(source, events=('start', 'end'))
+    if include is not None or exclude is not None:
+        events = _filter_events(events, include, exclude)
+    return events
+
+
+def _pull_events(parser):
+    '''Yield an XMLPullParser's events, then (None, None) when it has none left for now. Forever.
+    See _iterrecords()'''
+    while True:
+        for event in parser.read_events():
+            yield event
+        yield None, None
+
+
+def _selector(root, include, exclude):
+    '''Return fn(node) that returns the child elements of node that pass include / exclude'''
+    tags = paths.ancestors(root)
+    keep = set(elem for event, elem in _filter_events(
+        _tree_events(root), include, exclude, tags, clear=False) if event == 'start')
+
+    def children(node):
+        return [child for child in _children(node) if child in keep]
+
+    return children
+
+
 class XMLData(object):
+    # _build() returns {tag: value}. (Parker returns just the value)
+    _keyed = True
+
     def __init__(self, xml_fromstring=True, xml_tostring=True, element=None, dict_type=None,
                  list_type=None, attr_prefix=None, text_content=None, simple_text=False,
-                 invalid_tags=None):
+                 invalid_tags=None, fromstring_cache=None, types=None, compact=False,
+                 shared=False, pack=False, batch=False):
+        # Attributes set by a subclass before calling this are pickled with the options
+        preset = set(self.__dict__)
+        # Remember the options, to re-create this dialect when unpickled
+        self._options = dict(
+            xml_fromstring=xml_fromstring, xml_tostring=xml_tostring, element=element,
+            dict_type=dict_type, list_type=list_type, attr_prefix=attr_prefix,
+            text_content=text_content, simple_text=simple_text, invalid_tags=invalid_tags,
+            fromstring_cache=fromstring_cache, types=types, compact=compact,
+            shared=shared, pack=pack, batch=batch)
         # xml_fromstring == False(y) => '1' -> '1'
         # xml_fromstring == True     => '1' -> 1
         # xml_fromstring == fn       => '1' -> fn(1)
         if callable(xml_fromstring):
             self._fromstring = xml_fromstring
         elif not xml_fromstring:
-            self._fromstring = lambda v: v
+            self._fromstring = _identity
+        # fromstring_cache == n => remember conversions of the n most recent distinct values.
+        # Speeds up documents that repeat values, e.g. status="active", currency="USD"
+        if fromstring_cache:
+            self._fromstring = _memoize(self._fromstring, fromstring_cache)
+        # types == {'item/price': float, 'item/@id': int, 'zip': str} or an XSD file converts
+        # values at those paths with that type instead of xml_fromstring. See xmljson.paths
+        if types is None or isinstance(types, Schema):
+            self._schema = types
+        elif isinstance(types, dict):
+            self._schema = Schema(types)
+        else:
+            self._schema = Schema.from_xsd(types)
         # custom conversion function to convert data string to XML string
         if callable(xml_tostring):
             self._tostring = xml_tostring
         # custom etree.Element to use
         self.element = Element if element is None else element
         # dict constructor (e.g. OrderedDict, defaultdict)
-        self.dict = OrderedDict if dict_type is None else dict_type
+        # compact == True => use dict, which is smaller and faster (and ordered since Python 3.7)
+        self.dict = (dict if compact else OrderedDict) if dict_type is None else dict_type
+        # Keys for tags and attributes. Elements share these instead of each making their own
+        self._tags = _Names()
+        self._attrs = _Names(attr_prefix)
+        self._shapes = _Shapes()
+        # Whether .element() accepts each tag, and ' name="' for valid attribute names, for
+        # writing XML
+        self._valid, self._valid_attrs = {}, {}
+        # shared == True => .data() returns frozen dicts and tuples. Identical subtrees are one
+        # object. See xmljson.shared
+        self._shared = None
+        if shared:
+            self._shared = FrozenDict if self.dict is dict else FrozenOrderedDict
+        # pack == True => .data() returns lists of ints as array('q') and lists of numbers as
+        # array('d'), which use a fraction of the memory. Only Parker has such lists (others
+        # hold dicts). Arrays are not JSON serializable. See xmljson.columns.pack
+        if pack and shared:
+            raise ValueError('pack=True returns arrays, which cannot be shared. Use one or the '
+                             'other')
+        self._pack = pack
+        # batch == True => .data() converts the texts of 4+ leaf siblings with the same tag (e.g.
+        # a row of numbers) in bulk. Only Parker, whose leaves are just their converted text,
+        # and only with the default xml_fromstring. See _fromstrings()
+        self._batch = batch and not self._keyed and xml_fromstring is True
         # list constructor (e.g. UserList)
         self.list = list if list_type is None else list_type
         # Prefix attributes with a string (e.g. '$')
@@ -50,6 +507,16 @@ class XMLData(object):
             self.element = self._make_valid_element
         elif invalid_tags is not None:
             raise TypeError('invalid_tags can be "drop" or None, not "%s"' % invalid_tags)
+        # Names of the attributes re-created from the options when unpickled
+        self._derived = None
+        self._derived = frozenset(self.__dict__) - preset
+
+    def __reduce__(self):
+        # Caches and wrapped functions cannot be pickled. Re-create them from the options.
+        # Other attributes (e.g. those set by a subclass's __init__) are pickled as-is
+        state = dict((key, value) for key, value in self.__dict__.items()
+                     if key not in self._derived)
+        return _unpickle, (self.__class__, self._options), state or None
 
     def _make_valid_element(self, key):
         try:
@@ -75,12 +542,32 @@ class XMLData(object):
         if value is None:
             return None
 
+        # Fast path: plain ASCII numbers are matched in a single scan
+        match = _number.match(value)
+        if match is not None:
+            try:
+                if match.lastindex is None:
+                    return int(value)
+                number = float(value)
+                # Infinity (e.g. 1e999) stays a string
+                return number if number - number == 0 else value
+            except ValueError:
+                # int() refuses more than 4300 digits. Let the slow path decide
+                pass
+
         # FIXME: In XML, booleans are either 0/false or 1/true (lower-case !)
-        if value.lower() == 'true':
-            return True
-        elif value.lower() == 'false':
-            return False
+        if 4 <= len(value) <= 5:
+            lower = value.lower()
+            if lower == 'true':
+                return True
+            elif lower == 'false':
+                return False
+
+        # Without a digit, it cannot be an int or a finite float
+        if _digit.search(value) is None:
+            return value
 
+        # Slow path for whitespace, underscores, non-ASCII digits, etc.
         # FIXME: Using int() or float() is eating whitespaces unintendedly here
         try:
             return int(value)
@@ -101,7 +588,7 @@ class XMLData(object):
         result = self.list() if root is None else root
         if isinstance(data, (self.dict, dict)):
             for key, value in data.items():
-                value_is_list = isinstance(value, (self.list, list))
+                value_is_list = isinstance(value, (self.list, list, tuple, array))
                 value_is_dict = isinstance(value, (self.dict, dict))
                 # Add attributes and text to result (if root)
                 if root is not None:
@@ -133,7 +620,7 @@ class XMLData(object):
                         continue
                     result.append(elem)
                     # Treat scalars as text content, not children (Parker)
-                    if not isinstance(value, (self.dict, dict, self.list, list)):
+                    if not isinstance(value, (self.dict, dict, self.list, list, tuple, array)):
                         if self.text_content:
                             value = {self.text_content: value}
                     self.etree(value, root=elem)
@@ -146,31 +633,524 @@ class XMLData(object):
                     result.append(elem)
         return result
 
-    def data(self, root):
-        '''Convert etree.Element into a dictionary'''
+    def to_xml(self, source, out, root=None):
+        '''Write XML for the JSON in the file object source to out (a filename or binary file).
+
+        Uses the same rules as .etree(), but reads JSON and writes XML incrementally, so large
+        files need little memory. If the JSON is an array, each item is converted like .etree()
+        would. root= wraps the output in a root element, like .etree(data, root=...). It is
+        required if there is more than one top-level element. Keys that become attributes or
+        text must come before keys that become child elements.
+        '''
+        from lxml.etree import xmlfile
+        events = decoder.iterevents(source)
+        event = next(events)
+        with xmlfile(out, encoding='utf-8') as xf:
+            elem = None if root is None else _OpenElement(xf, root)
+            if event[0] == 'start_array':
+                for event in events:
+                    if event[0] == 'end_array':
+                        break
+                    self._stream(xf, event, events, elem)
+            else:
+                self._stream(xf, event, events, elem)
+            if elem is not None:
+                elem.close()
+
+    def _is_valid(self, key):
+        '''Check if .element() creates an element for key. (invalid_tags='drop' skips some)'''
+        valid = self._valid.get(key)
+        if valid is None:
+            valid = self.element(key) is not None
+            if len(self._valid) < _Names.size:
+                self._valid[key] = valid
+        return valid
+
+    def _attr_start(self, name):
+        '''Return ' name="'. Raise a ValueError if name is not a valid attribute name, like
+        Element.set() does'''
+        start = self._valid_attrs.get(name)
+        if start is None:
+            if name[:1] == '{':
+                raise serializer.Namespaced(name)
+            Element('_').set(name, '')
+            start = ' %s="' % name
+            if len(self._valid_attrs) < _Names.size:
+                self._valid_attrs[name] = start
+        return start
+
+    def to_xml_bytes(self, data, root=None):
+        '''Return the XML for data as UTF-8 bytes, without creating etree.Elements.
+
+        Uses the same rules as .etree(), and returns what ``tostring(elem, encoding='utf-8')``
+        returns for each element of .etree(data), joined. root= wraps the output in a root
+        element, like .etree(data, root=Element(root)). Faster than .etree() and tostring().
+        '''
+        out = []
+        try:
+            if root is None:
+                for tag, value in self._xml_parts(data, False)[2]:
+                    if self._is_valid(tag):
+                        self._write_element(tag, self._element_parts(value), out)
+            else:
+                self._write_element(root, self._xml_parts(data, True), out)
+        except serializer.Namespaced:
+            # {namespace}tags need namespace declarations (ns0:, ...). Let lxml add them
+            top = None if root is None else Element(root)
+            elems = self.etree(data, top)
+            return b''.join(tostring(elem, encoding='utf-8')
+                            for elem in (elems if top is None else [top]))
+        return u''.join(out).encode('utf-8')
+
+    def _write_element(self, tag, parts, out):
+        '''Append the XML text for a <tag> element with _xml_parts() parts to the list out'''
+        if tag[:1] == '{':
+            raise serializer.Namespaced(tag)
+        attrs, text, children = parts
+        out += ['<', tag]
+        if attrs:
+            starts, attr = self._valid_attrs, serializer.attr
+            for key, value in attrs.items():
+                out += [starts.get(key) or self._attr_start(key), attr(value), '"']
+        # If nothing follows the start tag, write <tag/>
+        end = len(out)
+        out.append('>')
+        if text:
+            out.append(serializer.text(text))
+        for key, value in children:
+            if self._is_valid(key):
+                self._write_element(key, self._element_parts(value), out)
+        if text is None and len(out) == end + 1:
+            out[end] = '/>'
+        else:
+            out += ['</', tag, '>']
+
+    def _xml_parts(self, data, root):
+        '''Return (attributes, text, [(tag, data), ...]) that .etree(data, root=elem) gives elem.
+        If root is False, like .etree(data), only the list of child elements matters.
+
+        Mirrors .etree(), but collects attributes and text before children are written.
+        '''
+        attrs, text, children = None, None, []
+        dicts, lists = (self.dict, dict), (self.list, list, tuple, array)
+        prefix, text_content = self.attr_prefix, self.text_content
+        if isinstance(data, dicts):
+            for key, value in data.items():
+                # Add attributes and text to result (if root)
+                if root:
+                    # Handle attribute prefixes (BadgerFish)
+                    if prefix is not None:
+                        if key.startswith(prefix):
+                            key = key.lstrip(prefix)
+                            if isinstance(value, dicts):
+                                raise ValueError('XML namespaces not yet supported')
+                            attrs = OrderedDict() if attrs is None else attrs
+                            attrs[key] = self._tostring(value)
+                            continue
+                    # Handle text content (BadgerFish, GData)
+                    if text_content is not None:
+                        if key == text_content:
+                            text = self._tostring(value)
+                            continue
+                    # Treat scalars as text content, not children (GData)
+                    if prefix is None and text_content is not None:
+                        if not isinstance(value, dicts) and not isinstance(value, lists):
+                            attrs = OrderedDict() if attrs is None else attrs
+                            attrs[key] = self._tostring(value)
+                            continue
+                # Add other keys as one or more children
+                for value in (value if isinstance(value, lists) else [value]):
+                    # Treat scalars as text content, not children (Parker)
+                    if text_content and not isinstance(value, dicts) and \
+                            not isinstance(value, lists):
+                        value = {text_content: value}
+                    children.append((key, value))
+        elif self.text_content is None and root:
+            text = self._tostring(data)
+        else:
+            # An empty element named after the value
+            children.append((self._tostring(data), {}))
+        return attrs, text, children
+
+    def _element_parts(self, value):
+        '''Return _xml_parts() for the element .etree() creates for a (tag, value) child'''
+        return self._xml_parts(value, True)
+
+    def write_xml(self, data, fp, root=None):
+        '''Write .to_xml_bytes(data, root) to the binary file object fp'''
+        fp.write(self.to_xml_bytes(data, root))
+
+    def _stream_empty(self, xf, tag, elem):
+        '''Write an empty <tag/> inside elem'''
+        if self._is_valid(tag):
+            if elem is not None:
+                elem.open()
+            _OpenElement(xf, tag).close()
+
+    def _stream(self, xf, event, events, elem=None):
+        '''Write the JSON value starting with event into elem. Mirrors .etree(data, root=elem)'''
+        if event[0] != 'start_map':
+            data = decoder.value(event, events)
+            if self.text_content is None and elem is not None:
+                elem.set_text(self._tostring(data))
+            else:
+                self._stream_empty(xf, self._tostring(data), elem)
+            return
+        for kind, key in events:
+            if kind == 'end_map':
+                break
+            event = next(events)
+            value_is_dict = event[0] == 'start_map'
+            value_is_list = event[0] == 'start_array'
+            # Add attributes and text to result (if root)
+            if elem is not None:
+                # Handle attribute prefixes (BadgerFish)
+                if self.attr_prefix is not None:
+                    if key.startswith(self.attr_prefix):
+                        key = key.lstrip(self.attr_prefix)
+                        if value_is_dict:
+                            raise ValueError('XML namespaces not yet supported')
+                        elem.set(key, self._tostring(decoder.value(event, events)))
+                        continue
+                # Handle text content (BadgerFish, GData)
+                if self.text_content is not None:
+                    if key == self.text_content:
+                        elem.set_text(self._tostring(decoder.value(event, events)))
+                        continue
+                # Treat scalars as text content, not children (GData)
+                if self.attr_prefix is None and self.text_content is not None:
+                    if not value_is_dict and not value_is_list:
+                        elem.set(key, self._tostring(decoder.value(event, events)))
+                        continue
+            # Add other keys as one or more children
+            if value_is_list:
+                for event in events:
+                    if event[0] == 'end_array':
+                        break
+                    self._stream_child(xf, key, event, events, elem)
+            else:
+                self._stream_child(xf, key, event, events, elem)
+
+    def _stream_child(self, xf, key, event, events, elem):
+        '''Write a <key> child with the JSON value starting with event into elem'''
+        if not self._is_valid(key):
+            decoder.skip(event, events)
+            return
+        if elem is not None:
+            elem.open()
+        child = _OpenElement(xf, key)
+        # Treat scalars as text content, not children (Parker)
+        if decoder.is_scalar(event) and self.text_content:
+            child.set_text(self._tostring(event[1]))
+        else:
+            self._stream(xf, event, events, child)
+        child.close()
+
+    def _convert(self, root, build, select=_children):
+        '''Return build(node, children, values, path) for root. children are the node's child
+        elements (from select(node)) and values are the build() results for each child. path is
+        the tuple of tags from the document root to node if types= is used, else None.
+
+        Uses an explicit stack instead of recursion, so documents of any depth can be converted.
+        '''
+        children = select(root)
+        path = None if self._schema is None else paths.ancestors(root) + (root.tag, )
+        # stats() counts each leaf's build(), so convert leaves one by one while it collects
+        batch = self._batch and path is None and '_collecting' not in self.__dict__
+        stack = [(root, children, iter(children), [], path)]
+        while True:
+            node, children, pending, values, path = stack[-1]
+            # Only the first visit of a node has no values yet
+            if batch and not values and len(children) >= _batch_size and \
+                    children[0].tag == children[-1].tag and \
+                    not any(select(child) for child in children):
+                converted = _fromstrings([child.text for child in children])
+                if converted is not None:
+                    values.extend(converted)
+                    pending = ()
+            for child in pending:
+                grandchildren = select(child)
+                child_path = None if path is None else path + (child.tag, )
+                if grandchildren:
+                    stack.append((child, grandchildren, iter(grandchildren), [], child_path))
+                    break
+                # Convert leaf nodes right away: they need no stack frame
+                values.append(build(child, grandchildren, (), child_path))
+            else:
+                stack.pop()
+                value = build(node, children, values, path)
+                if not stack:
+                    return value
+                stack[-1][3].append(value)
+
+    def _convert_events(self, events, build):
+        '''Return (root, build() result for root) from iterparse-style (event, element) pairs.
+
+        Each element is converted when it ends. Its result is encoded into JSON text (encoder.Raw)
+        for its parent, and the element is cleared and removed. So the tree and the data are
+        never fully held in memory -- only the open elements and the text of their children.
+        '''
+        stack, stand_ins = [], {}
+        for event, elem in events:
+            if event == 'start':
+                path = None
+                if self._schema is not None:
+                    path = (stack[-1][3] if stack else ()) + (elem.tag, )
+                stack.append((elem, [], [], path))
+                continue
+            elem, children, values, path = stack.pop()
+            value = build(elem, children, values, path)
+            if not stack:
+                return elem, value
+            if self._keyed:
+                value = self.dict((key, encoder.encode(item)) for key, item in value.items())
+            else:
+                value = encoder.encode(value)
+            parent, siblings, sibling_values = stack[-1][:3]
+            child = stand_ins.get(elem.tag)
+            if child is None:
+                child = stand_ins[elem.tag] = _Child(elem.tag)
+            siblings.append(child)
+            sibling_values.append(value)
+            elem.clear()
+            _drop_preceding(parent, elem)
+
+    def _converter(self, path, attr=None, default=None):
+        '''Return the function that converts the text (or attr) of the element at path'''
+        default = self._fromstring if default is None else default
+        if path is None:
+            return default
+        return self._schema.get(path if attr is None else path + ('@' + attr, ), default)
+
+    def data(self, root, include=None, exclude=None):
+        '''Convert etree.Element into a dictionary.
+
+        include and exclude are lists of tag paths (see xmljson.paths). Elements matching exclude
+        are skipped. If include is given, only matching elements (and those containing them) are
+        converted. Paths start from the document root, so they also match root's ancestors.
+        root itself is always converted, but has no children if an ancestor (other than the
+        document root) is excluded.
+        '''
+        build = self._build
+        if self._shared is not None:
+            share = Sharer(self._shared)
+            build = share.build(build, self._keyed)
+        if include is None and exclude is None:
+            value = self._convert(root, build)
+        else:
+            value = self._convert(root, build, _selector(root, include, exclude))
+        if self._pack:
+            from .columns import pack
+            value = pack(value)
+        return value if self._shared is None else share(value)
+
+    def view(self, root):
+        '''Return a read-only view of .data(root) that converts values only when they are read.
+
+        Reading a few values of a large document is much faster than .data(). The view is a
+        Mapping with the same keys and values as .data(root), and json.dumps() or dict() work
+        on it. Converted values are cached. Lists are converted one level deep when read.
+        '''
+        path = None if self._schema is None else paths.ancestors(root) + (root.tag, )
+        return self._resolve(self._build_shallow(root, path))
+
+    def _build_shallow(self, node, path):
+        '''Return build() for node, with a Pending placeholder for each child's value'''
+        children = _children(node)
+        values = []
+        for child in children:
+            child_path = None if path is None else path + (child.tag, )
+            value = Pending(child, child_path)
+            values.append(self.dict([(self._tags[child.tag], value)]) if self._keyed else value)
+        return self._build(node, children, values, path)
+
+    def _resolve(self, value):
+        '''Convert a Pending placeholder into its view. Wrap dicts and lists that hold them'''
+        if isinstance(value, Pending):
+            value = self._build_shallow(value.elem, value.path)
+            if self._keyed:
+                value = next(iter(value.values()))
+        if isinstance(value, (self.dict, dict)):
+            return value if isinstance(value, View) else View(self._resolve, value.items())
+        if isinstance(value, (self.list, list)):
+            return self.list(self._resolve(item) for item in value)
+        return value
+
+    def stats(self, result=None):
+        '''Count and time conversions with this instance in a with block. For example::
+
+            with badgerfish.stats() as result:
+                badgerfish.data(root)
+            print(result.nodes, result.values, result.times)
+
+        Returns a context manager yielding an xmljson.stats.Stats (or result, to add to it).
+        Only counts xml_fromstring values, not types= values. Costs nothing outside the block.
+        Not thread-safe on a shared instance: blocks on one instance cannot overlap (a second
+        raises RuntimeError), and conversions from other threads are counted too.
+        '''
+        return stats.collect(self, stats.Stats() if result is None else result)
+
+    def _build(self, root, children, values, path=None):
+        '''Convert an element into a dictionary, given the .data() of its children'''
         value = self.dict()
-        children = [node for node in root if isinstance(node.tag, basestring)]
+        convert = self._fromstring
+        tags, attrs = self._tags, self._attrs
         for attr, attrval in root.attrib.items():
-            attr = attr if self.attr_prefix is None else self.attr_prefix + attr
-            value[attr] = self._fromstring(attrval)
+            if path is not None:
+                convert = self._converter(path, attr)
+            value[attrs[attr]] = convert(attrval)
         if root.text and self.text_content is not None:
             text = root.text
             if text.strip():
+                if path is not None:
+                    convert = self._converter(path)
                 if self.simple_text and len(children) == len(root.attrib) == 0:
-                    value = self._fromstring(text)
+                    value = convert(text)
                 else:
-                    value[self.text_content] = self._fromstring(text)
-        count = Counter(child.tag for child in children)
-        for child in children:
-            if count[child.tag] == 1:
-                value.update(self.data(child))
+                    value[self.text_content] = convert(text)
+        repeated = _unique[len(children)] if len(children) < 2 else \
+            self._shapes.repeated(children)
+        for child, child_data, many in zip(children, values, repeated):
+            if not many:
+                value.update(child_data)
             else:
-                result = value.setdefault(child.tag, self.list())
-                result += self.data(child).values()
+                result = value.setdefault(tags[child.tag], self.list())
+                result += child_data.values()
         # if simple_text, elements with no children nor attrs become '', not {}
         if isinstance(value, dict) and not value and self.simple_text:
             value = ''
-        return self.dict([(root.tag, value)])
+        return self.dict([(tags[root.tag], value)])
+
+    def to_json(self, source, out, include=None, exclude=None):
+        '''Write json.dumps(.data()) for an XML file (name or file object) to the file out.
+
+        Elements are converted and encoded as they are parsed. Neither the tree nor the data is
+        built, so this uses much less memory than .data() on large documents. include and
+        exclude work like in .data(). Skipped elements are cleared as soon as they are parsed.
+        '''
+        root, value = self._convert_events(_parse_events(source, include, exclude), self._build)
+        encoder.write(value, out)
+
+    def iterdata(self, source, tag, include=None, exclude=None, **kwargs):
+        '''Yield .data() for each element matching tag in an XML file, without loading it all.
+
+        source is a filename or file object. tag is a tag name (``'item'``) or a record path
+        (``'channel/item'``, ``'/rss/channel/item'``). include and exclude work like in .data().
+        Skipped elements are cleared as soon as they are parsed. Other keyword arguments go to
+        .data().
+        '''
+        if include is not None or exclude is not None:
+            kwargs.update(include=include, exclude=exclude)
+        for elem in _iterrecords(_parse_events(source, include, exclude), tag):
+            yield self.data(elem, **kwargs)
+
+    def columns(self, source, tag, missing=None, arrays=None, include=None, exclude=None,
+                **kwargs):
+        '''Return {column: values} for the elements matching tag, instead of a list of records.
+
+        source is an element, or a filename or file object to parse incrementally. tag is a
+        record path (see .iterdata()). Each record's .data() is flattened: nested keys are
+        joined with ``/``, e.g. ``@id``, ``name/$``. A record without a column has missing
+        there. arrays='array' returns array.array for int and float columns without gaps.
+        arrays='numpy' returns NumPy arrays, masked where values are missing. include, exclude
+        and other keyword arguments go to .data(). See xmljson.columns.
+        '''
+        return next(self.itercolumns(source, tag, None, missing, arrays, include, exclude,
+                                     **kwargs))
+
+    def itercolumns(self, source, tag, size=10000, missing=None, arrays=None, include=None,
+                    exclude=None, **kwargs):
+        '''Yield .columns() for each batch of size records. size=None yields one batch of all.
+
+        Only one batch is held in memory. Each batch has the columns of its records and of all
+        earlier batches, so a column that a batch's records lack is all missing.
+        '''
+        from .columns import Columns, records
+        if include is not None or exclude is not None:
+            kwargs.update(include=include, exclude=exclude)
+        batch = Columns(self)
+        for elem in records(source, tag, include, exclude):
+            batch.add(elem, self.data(elem, **kwargs))
+            if batch.count == size:
+                yield batch.finish(missing, arrays)
+                batch = Columns(self, list(batch.columns))
+        if batch.count or size is None:
+            yield batch.finish(missing, arrays)
+
+    def aiter_data(self, stream, tag, include=None, exclude=None, executor=None,
+                   executor_size=65536, **kwargs):
+        '''Asynchronously yield .data() for each element matching tag in XML from stream.
+
+        Like .iterdata(), but for ``async for`` (Python 3.6+). stream is an async iterable of
+        bytes, or has an ``async read(size)`` method, like an HTTP response body. Records are
+        converted as the bytes arrive, and the next bytes are only read when the records so far
+        are consumed. Records in chunks of executor_size bytes or more are converted in executor
+        (default: the loop's) so that other tasks are not held up. executor_size=None converts
+        all records in the event loop. Other keyword arguments go to .data().
+        '''
+        from .aio import aiter_data
+        if include is not None or exclude is not None:
+            kwargs.update(include=include, exclude=exclude)
+        return aiter_data(self, stream, tag, include, exclude, executor, executor_size, kwargs)
+
+    def feeder(self, tag=None, callback=None, include=None, exclude=None, **kwargs):
+        '''Return an xmljson.feeder.Feeder that converts XML pushed to it in chunks.
+
+        Call ``.feed(data)`` with each chunk of bytes and ``.close()`` at the end. Each element
+        matching tag (see .iterdata()) is converted with .data() as soon as it ends, and passed
+        to callback(record). Without a callback, ``.read_records()`` yields the records so far.
+        The data can hold several XML documents one after another. With tag=None, each
+        document's root is a record. include, exclude and other keyword arguments work like in
+        .iterdata().
+        '''
+        from .feeder import Feeder
+        if include is not None or exclude is not None:
+            kwargs.update(include=include, exclude=exclude)
+        return Feeder(self, tag, callback, include, exclude, kwargs)
+
+    def cache(self, size=1024, path=None):
+        '''Return an xmljson.cache.Cache whose ``.convert(doc)`` returns .data() for XML bytes.
+
+        Results are cached by a hash of the document and this dialect's options. size is the
+        number of results kept in memory (least recently used are dropped). path is an SQLite
+        file that also stores them, shared across processes and runs. Each call returns a copy,
+        so changing it does not change the cache (unless shared=True, which is read-only).
+        '''
+        from .cache import Cache
+        return Cache(self, size, path)
+
+    def data_many(self, docs, workers=None, chunksize=64, ordered=True, start_method=None,
+                  **kwargs):
+        '''Yield .data() for each XML document (bytes or string) in docs, using a process pool.
+
+        workers is the number of processes (default: number of CPUs). Documents are sent to
+        workers, and results returned, in lists of chunksize. Results are in the order of docs.
+        ordered=False yields each chunk as soon as it is done instead. Other keyword arguments
+        go to .data().
+
+        start_method is the multiprocessing start method (default: the platform's). Choosing one
+        needs Python 3.7+. The dialect is pickled and sent to the workers with the documents. A
+        dialect that cannot be pickled (e.g. with a lambda for xml_fromstring) only works with
+        'fork', where workers inherit it as-is.
+        '''
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        workers = workers or multiprocessing.cpu_count()
+        context = multiprocessing.get_context(start_method)
+        config = _share_state((self, kwargs), context.get_start_method())
+        # mp_context needs Python 3.7+
+        options = {} if start_method is None else {'mp_context': context}
+        with ProcessPoolExecutor(workers, **options) as pool:
+            # Read docs lazily, keeping a few chunks per worker in flight
+            futures = deque()
+            for chunk in _chunks(docs, chunksize):
+                futures.append(pool.submit(_data_chunk, config, chunk))
+                while len(futures) > 2 * workers:
+                    for result in _next_results(futures, ordered):
+                        yield result
+            while futures:
+                for result in _next_results(futures, ordered):
+                    yield result
 
 
 class BadgerFish(XMLData):
@@ -194,31 +1174,52 @@ class Yahoo(XMLData):
 
 class Parker(XMLData):
     '''Converts between XML and data using the Parker convention'''
+    _keyed = False
+
     def __init__(self, **kwargs):
         super(Parker, self).__init__(**kwargs)
 
-    def data(self, root, preserve_root=False):
-        '''Convert etree.Element into a dictionary'''
-        # If preserve_root is False, return the root element. This is easiest
-        # done by wrapping the XML in a dummy root element that will be ignored.
+    def data(self, root, preserve_root=False, include=None, exclude=None):
+        '''Convert etree.Element into a dictionary. See XMLData.data() for include, exclude'''
+        value = super(Parker, self).data(root, include, exclude)
+        # If preserve_root is True, wrap the value in the root's tag. Unlike inserting root
+        # into a dummy parent, this does not move root out of its tree
+        if preserve_root:
+            value = (self.dict if self._shared is None else self._shared)([(root.tag, value)])
+        return value
+
+    def view(self, root, preserve_root=False):
+        '''Return a read-only view of .data(root) that converts values only when they are read'''
+        value = super(Parker, self).view(root)
+        if preserve_root:
+            value = View(self._resolve, [(root.tag, value)])
+        return value
+
+    def to_json(self, source, out, preserve_root=False, include=None, exclude=None):
+        '''Write json.dumps(.data()) for an XML file (name or file object) to the file out'''
+        root, value = self._convert_events(_parse_events(source, include, exclude), self._build)
         if preserve_root:
-            new_root = root.makeelement('dummy_root', {})
-            new_root.insert(0, root)
-            root = new_root
+            value = self.dict([(root.tag, value)])
+        encoder.write(value, out)
 
+    def _build(self, root, children, values, path=None):
+        '''Convert an element into a dictionary, given the .data() of its children'''
         # If no children, just return the text
-        children = [node for node in root if isinstance(node.tag, basestring)]
         if len(children) == 0:
+            if path is not None:
+                return self._converter(path)(root.text)
             return self._fromstring(root.text)
 
         # Element names become object properties
-        count = Counter(child.tag for child in children)
+        repeated = _unique[len(children)] if len(children) < 2 else \
+            self._shapes.repeated(children)
         result = self.dict()
-        for child in children:
-            if count[child.tag] == 1:
-                result[child.tag] = self.data(child)
+        tags = self._tags
+        for child, child_data, many in zip(children, values, repeated):
+            if not many:
+                result[tags[child.tag]] = child_data
             else:
-                result.setdefault(child.tag, self.list()).append(self.data(child))
+                result.setdefault(tags[child.tag], self.list()).append(child_data)
 
         return result
 
@@ -228,8 +1229,8 @@ class Abdera(XMLData):
     def __init__(self, **kwargs):
         super(Abdera, self).__init__(simple_text=True, text_content=True, **kwargs)
 
-    def data(self, root):
-        '''Convert etree.Element into a dictionary'''
+    def _build(self, root, children, values, path=None):
+        '''Convert an element into a dictionary, given the .data() of its children'''
 
         value = self.dict()
 
@@ -237,24 +1238,23 @@ class Abdera(XMLData):
         if root.attrib:
             value['attributes'] = self.dict()
             for attr, attrval in root.attrib.items():
-                value['attributes'][unicode(attr)] = self._fromstring(attrval)
+                convert = self._converter(path, attr)
+                value['attributes'][self._attrs[attr]] = convert(attrval)
 
         # Add children to specific 'children' key
         children_list = self.list()
-        children = [node for node in root if isinstance(node.tag, basestring)]
 
         # Add root text
         if root.text and self.text_content is not None:
             text = root.text
             if text.strip():
+                convert = self._converter(path)
                 if self.simple_text and len(children) == len(root.attrib) == 0:
-                    value = self._fromstring(text)
+                    value = convert(text)
                 else:
-                    children_list = [self._fromstring(text), ]
+                    children_list = [convert(text), ]
 
-        for child in children:
-            child_data = self.data(child)
-            children_list.append(child_data)
+        children_list.extend(values)
 
         # Flatten children
         if len(root.attrib) == 0 and len(children_list) == 1:
@@ -263,7 +1263,7 @@ class Abdera(XMLData):
         elif len(children_list) > 0:
             value['children'] = children_list
 
-        return self.dict([(unicode(root.tag), value)])
+        return self.dict([(self._tags[root.tag], value)])
 
 
 # The difference between Cobra and Abdera is that Cobra _always_ has 'attributes' keys,
@@ -293,7 +1293,7 @@ class Cobra(XMLData):
                     #     raise ValueError('Cobra requires "attributes" key for each element')
 
                     if 'children' in value:
-                        for v in value['children']:
+                        for v in self._child_list(value['children']):
                             self.etree(v, root=elem)
                 else:
                     elem = self.element(key)
@@ -311,46 +1311,123 @@ class Cobra(XMLData):
 
         return result
 
-    def data(self, root):
-        '''Convert etree.Element into a dictionary'''
+    @staticmethod
+    def _child_list(children):
+        '''Return a "children" value as a list. A single child (dict or scalar) needs no list'''
+        if isinstance(children, (dict, basestring, bytes)) or not hasattr(children, '__iter__'):
+            return [children]
+        return children
+
+    def _xml_parts(self, data, root):
+        '''Return (attributes, text, [(tag, value), ...]) that .etree(data, root=elem) gives elem.
+        Mirrors .etree()'''
+        if isinstance(data, (self.dict, dict)):
+            return None, None, list(data.items())
+        if root:
+            return None, self._tostring(data), []
+        return None, None, [(self._tostring(data), {})]
+
+    def _element_parts(self, value):
+        '''Return _xml_parts() for the element .etree() creates for a (tag, value) child'''
+        if not isinstance(value, (self.dict, dict)):
+            return None, self._tostring(value), []
+        attrs, text, children = None, None, []
+        if 'attributes' in value:
+            attrs = OrderedDict((key, self._tostring(val))
+                                for key, val in value['attributes'].items())
+        if 'children' in value:
+            for child in self._child_list(value['children']):
+                child_text, grandchildren = self._xml_parts(child, True)[1:]
+                # Like elem.text = ..., the last text wins
+                text = text if child_text is None else child_text
+                children += grandchildren
+        return attrs, text, children
+
+    def _stream(self, xf, event, events, elem=None):
+        '''Write the JSON value starting with event into elem. Mirrors .etree(data, root=elem)'''
+        if event[0] != 'start_map':
+            data = decoder.value(event, events)
+            if elem is not None:
+                elem.set_text(self._tostring(data))
+            else:
+                self._stream_empty(xf, self._tostring(data), elem)
+            return
+        for kind, key in events:
+            if kind == 'end_map':
+                break
+            event = next(events)
+            if not self._is_valid(key):
+                decoder.skip(event, events)
+                continue
+            if elem is not None:
+                elem.open()
+            child = _OpenElement(xf, key)
+            if event[0] != 'start_map':
+                child.set_text(self._tostring(decoder.value(event, events)))
+                child.close()
+                continue
+            for kind, name in events:
+                if kind == 'end_map':
+                    break
+                event = next(events)
+                if name == 'attributes':
+                    for k, v in decoder.value(event, events).items():
+                        child.set(k, self._tostring(v))
+                elif name == 'children' and event[0] == 'start_array':
+                    for event in events:
+                        if event[0] == 'end_array':
+                            break
+                        self._stream(xf, event, events, child)
+                elif name == 'children':
+                    # Like .etree(), a single child needs no list
+                    self._stream(xf, event, events, child)
+                else:
+                    decoder.skip(event, events)
+            child.close()
+
+    def _build(self, root, children, values, path=None):
+        '''Convert an element into a dictionary, given the .data() of its children'''
 
         value = self.dict()
 
-        # Add attributes to 'attributes' key (sorted!) even when empty
+        # Add attributes to 'attributes' key (sorted!) even when empty. Keep them as strings
+        # unless types= specifies a type
         value['attributes'] = self.dict()
         if root.attrib:
             for attr in sorted(root.attrib):
-                value['attributes'][unicode(attr)] = root.attrib[attr]
+                convert = self._converter(path, attr, default=unicode)
+                value['attributes'][self._attrs[attr]] = convert(root.attrib[attr])
 
         # Add children to specific 'children' key
         children_list = self.list()
-        children = [node for node in root if isinstance(node.tag, basestring)]
 
         # Add root text
         if root.text and self.text_content is not None:
             text = root.text
             if text.strip():
+                convert = self._converter(path)
                 if self.simple_text and len(children) == len(root.attrib) == 0:
-                    value = self._fromstring(text)
+                    value = convert(text)
                 else:
-                    children_list = [self._fromstring(text), ]
+                    children_list = [convert(text), ]
 
-        count = Counter(child.tag for child in children)
-        for child in children:
-            child_data = self.data(child)
-            if (count[child.tag] == 1 and
+        # Each child is converted once: reuse child_data rather than calling .data(child) again
+        repeated = _unique[len(children)] if len(children) < 2 else \
+            self._shapes.repeated(children)
+        for child, child_data, many in zip(children, values, repeated):
+            if (not many and
                     len(children_list) > 1 and
                     isinstance(children_list[-1], dict)):
                 # Merge keys to existing dictionary
                 children_list[-1].update(child_data)
             else:
                 # Add additional text
-                children_list.append(self.data(child))
+                children_list.append(child_data)
 
         if len(children_list) > 0:
             value['children'] = children_list
 
-        return self.dict([(unicode(root.tag), value)])
+        return self.dict([(self._tags[root.tag], value)])
 
 
 abdera = Abdera()
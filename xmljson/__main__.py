@@ -1,8 +1,11 @@
+import os
 import sys
-import json
+import glob
+import time
 import argparse
 from contextlib import closing
 import xmljson
+from xmljson.output import Dumper, Output
 
 try:
     from lxml.etree import parse
@@ -16,6 +19,13 @@ dialects = {
 
 
 def parse_args(args=None, in_file=sys.stdin, out_file=sys.stdout):
+    '''Return (in_file, out_file, dialect) from the command line. See parse_options()'''
+    return parse_options(args, in_file, out_file)[:3]
+
+
+def parse_options(args=None, in_file=sys.stdin, out_file=sys.stdout):
+    '''Return (in_file, out_file, dialect, options) from the command line. options are the
+    keyword arguments for main(), e.g. stream, bulk, include and indent'''
     parser = argparse.ArgumentParser(prog='xmljson')
     parser.add_argument('in_file', type=argparse.FileType(), nargs='?', default=in_file,
                         help='defaults to stdin')
@@ -23,21 +33,289 @@ def parse_args(args=None, in_file=sys.stdin, out_file=sys.stdout):
                         help='defaults to stdout')
     parser.add_argument('-d', '--dialect', choices=list(dialects.keys()), default='parker',
                         type=str.lower, help='defaults to parker')
+    parser.add_argument('--stream', action='store_true',
+                        help='write one JSON line per record as it is parsed')
+    parser.add_argument('--record-tag', metavar='TAG',
+                        help='record tag or path for --stream (e.g. item, channel/item)')
+    parser.add_argument('--include', metavar='PATH', action='append',
+                        help='convert only elements at this tag path (e.g. item/title), and '
+                        'those containing them. Can be repeated')
+    parser.add_argument('--exclude', metavar='PATH', action='append',
+                        help='skip elements at this tag path (e.g. item/blob). Can be repeated')
+    parser.add_argument('--stats', action='store_true',
+                        help='print counts and time per phase (parse, data, fromstring, '
+                        'serialize) to stderr')
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument('--compact', dest='indent', action='store_const', const=None, default=2,
+                        help='write compact JSON on one line')
+    layout.add_argument('--indent', metavar='N', type=int, default=2,
+                        help='indent JSON by N spaces (default: 2)')
+    parser.add_argument('--utf8', action='store_true',
+                        help='write non-ASCII characters as UTF-8 instead of \\uXXXX escapes')
+    bulk = parser.add_argument_group('bulk conversion')
+    bulk.add_argument('--bulk', metavar='PATH', action='append',
+                      help='convert XML files: a file, a glob pattern, or a directory (*.xml '
+                      'in it and its subdirectories). Can be repeated')
+    bulk.add_argument('--out-dir', metavar='DIR',
+                      help='write a .json file per input file, or --ndjson shards, into DIR')
+    bulk.add_argument('--ndjson', action='store_true',
+                      help='write one JSON line per file, to out_file or to shards in --out-dir')
+    bulk.add_argument('--shard-size', metavar='N', type=int, default=100000,
+                      help='lines per --ndjson shard in --out-dir (default: 100000)')
+    bulk.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+                      help='number of processes for --bulk (default: 1)')
     args = parser.parse_args() if args is None else parser.parse_args(args)
 
     if args.dialect not in dialects:
         raise TypeError('Unknown dialect: %s' % args.dialect)
     else:
         dialect = dialects[args.dialect]()
+    if args.stream and not args.record_tag:
+        parser.error('--stream requires --record-tag')
+    if args.bulk and args.stream:
+        parser.error('--stream cannot be used with --bulk')
+    if args.bulk and not (args.out_dir or args.ndjson):
+        parser.error('--bulk requires --out-dir or --ndjson')
+    if args.bulk and args.stats:
+        parser.error('--stats cannot be used with --bulk')
 
-    return args.in_file, args.out_file, dialect
+    return args.in_file, args.out_file, dialect, {
+        'stream': args.stream, 'record_tag': args.record_tag, 'bulk': args.bulk,
+        'out_dir': args.out_dir, 'ndjson': args.ndjson, 'shard_size': args.shard_size,
+        'jobs': args.jobs, 'stats': args.stats, 'include': args.include,
+        'exclude': args.exclude, 'indent': args.indent, 'utf8': args.utf8}
 
 
-def main(*test_args):
-    in_file, out_file, dialect = parse_args() if not test_args else test_args
+def main(*test_args, **options):
+    if not test_args:
+        in_file, out_file, dialect, options = parse_options()
+    else:
+        in_file, out_file, dialect = test_args
     with closing(in_file) as in_file, closing(out_file) as out_file:
-        json.dump(dialect.data(parse(in_file).getroot()), out_file, indent=2)
+        if options.get('bulk'):
+            failures = bulk(options['bulk'], out_file, dialect, options.get('out_dir'),
+                            options.get('ndjson'), options.get('shard_size', 100000),
+                            options.get('jobs', 1), filters=_filters(options),
+                            indent=options.get('indent', 2),
+                            ensure_ascii=not options.get('utf8'))
+            return 1 if failures else 0
+        elif options.get('stats'):
+            with dialect.stats() as result:
+                convert(in_file, out_file, dialect, options, result)
+            sys.stderr.write('%s\n' % result)
+        else:
+            convert(in_file, out_file, dialect, options, xmljson.stats.Stats())
+
+
+def _filters(options):
+    '''Return the include / exclude keyword arguments for .data() from the options'''
+    return {'include': options.get('include'), 'exclude': options.get('exclude')}
+
+
+def convert(in_file, out_file, dialect, options, result):
+    '''Write in_file as JSON to out_file. Add the time to parse and serialize to result.
+    options['indent'] is the JSON indent (default: 2), or None for compact JSON.
+    options['utf8'] writes non-ASCII characters as-is instead of as \\uXXXX'''
+    ensure_ascii = not options.get('utf8')
+    if options.get('stream'):
+        stream(in_file, out_file, dialect, options['record_tag'], result,
+               ensure_ascii=ensure_ascii, **_filters(options))
+    else:
+        with result.time('parse'):
+            root = parse(in_file).getroot()
+        data = dialect.data(root, **_filters(options))
+        with result.time('serialize'):
+            output = Output(out_file)
+            output.write(Dumper(options.get('indent', 2), ensure_ascii=ensure_ascii).dumps(data))
+            output.flush()
+
+
+def stream(in_file, out_file, dialect, record_tag, result=None, include=None, exclude=None,
+           ensure_ascii=True):
+    '''Write each record in in_file as a line of compact JSON (NDJSON) to out_file'''
+    result = xmljson.stats.Stats() if result is None else result
+    # iterparse needs bytes. Read from the binary buffer of text files (e.g. stdin)
+    in_file = getattr(in_file, 'buffer', in_file)
+    # Same as dialect.iterdata(), but parsing each record is timed separately from .data()
+    events = xmljson._parse_events(in_file, include, exclude)
+    records = xmljson._iterrecords(events, record_tag)
+    filters = {} if include is None and exclude is None else {
+        'include': include, 'exclude': exclude}
+    dumps, output = Dumper(ensure_ascii=ensure_ascii).dumps, Output(out_file)
+    while True:
+        with result.time('parse'):
+            elem = next(records, None)
+        if elem is None:
+            break
+        record = dialect.data(elem, **filters)
+        with result.time('serialize'):
+            output.write(dumps(record))
+            output.write(b'\n')
+    with result.time('serialize'):
+        output.flush()
+
+
+def find_files(patterns):
+    '''Return sorted (path, name) pairs for files, glob patterns or directories of XML files.
+    name is the path relative to the directory (or to the glob pattern's folder before its
+    first wildcard, or the file name), used to name the output'''
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = []
+            for folder, dirs, names in os.walk(pattern):
+                for name in names:
+                    if name.lower().endswith('.xml'):
+                        path = os.path.join(folder, name)
+                        found.append((path, os.path.relpath(path, pattern)))
+            files.extend(sorted(found))
+        else:
+            # A file that does not exist is reported as a failure, not skipped
+            if not glob.has_magic(pattern):
+                files.append((pattern, os.path.basename(pattern)))
+                continue
+            # a/*/x.xml matches a/b/x.xml and a/c/x.xml. Name them b/x.xml and c/x.xml
+            base = os.path.dirname(pattern)
+            while glob.has_magic(base):
+                base = os.path.dirname(base)
+            files.extend((path, os.path.relpath(path, base or os.curdir))
+                         for path in sorted(glob.glob(pattern)))
+    return files
+
+
+# The dialect and output options used by convert_file() in each worker process
+_bulk = {}
+
+
+def _init_bulk(dialect, out_dir, ndjson, filters, dumper):
+    _bulk.update(dialect=dialect, out_dir=out_dir, ndjson=ndjson, filters=filters, dumper=dumper)
+
+
+def _convert_task(config, task):
+    '''Run convert_file(task) in a worker process, with the options that bulk() sent'''
+    _init_bulk(*xmljson._load_state(config))
+    return convert_file(task)
+
+
+def convert_file(task):
+    '''Convert a (path, name) pair from find_files(). Return (path, size, line, error).
+
+    Writes name.json into the output directory, or returns the compact JSON line (as bytes) for
+    --ndjson.
+    Errors are returned as a string instead of raised, so one bad file does not stop the rest.
+    '''
+    path, name = task
+    line = None
+    try:
+        size = os.path.getsize(path)
+        data = _bulk['dialect'].data(parse(path).getroot(), **_bulk['filters'])
+        if _bulk['ndjson']:
+            line = _bulk['dumper'].dumps(data) + b'\n'
+        else:
+            target = os.path.join(_bulk['out_dir'], os.path.splitext(name)[0] + '.json')
+            folder = os.path.dirname(target)
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    # Another worker may have created it
+                    if not os.path.isdir(folder):
+                        raise
+            with open(target, 'wb') as handle:
+                handle.write(_bulk['dumper'].dumps(data))
+    except Exception as e:
+        return path, 0, None, '%s: %s' % (type(e).__name__, e)
+    return path, size, line, None
+
+
+class _Shards(object):
+    '''Writes lines to DIR/part-00000.ndjson, DIR/part-00001.ndjson, ... size lines each'''
+    def __init__(self, folder, size):
+        self.folder, self.size = folder, size
+        self.count, self.handle = 0, None
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def write(self, line):
+        if self.count % self.size == 0:
+            self.close()
+            name = 'part-%05d.ndjson' % (self.count // self.size)
+            self.handle = open(os.path.join(self.folder, name), 'wb')
+        self.handle.write(line)
+        self.count += 1
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+
+
+def bulk(patterns, out_file, dialect, out_dir=None, ndjson=False, shard_size=100000, jobs=1,
+         log=None, filters=None, indent=2, start_method=None, ensure_ascii=True):
+    '''Convert many XML files using jobs processes. Print a summary to log.
+
+    With ndjson, writes one line per file (in order) to shards in out_dir, or to out_file.
+    Otherwise writes one .json per file in out_dir, named as find_files() names it (raising a
+    ValueError if two files have the same name). filters are .data() keyword arguments, e.g.
+    include and exclude. .json files are indented by indent spaces (None for compact JSON).
+    ensure_ascii=False writes non-ASCII characters as-is instead of as \\uXXXX.
+    start_method is the multiprocessing start method (default: the platform's). Choosing one
+    needs Python 3.7+.
+    Returns the number of failed files.
+    '''
+    log = sys.stderr if log is None else log
+    start = time.time()
+    files = find_files(patterns)
+    if ndjson:
+        out = _Shards(out_dir, shard_size) if out_dir else Output(out_file)
+    else:
+        # Files with the same name (e.g. from different patterns) would overwrite each other
+        targets = {}
+        for path, name in files:
+            target = os.path.normcase(os.path.splitext(name)[0])
+            if target in targets:
+                raise ValueError('%s and %s are both written to %s.json' % (
+                    targets[target], path, os.path.splitext(name)[0]))
+            targets[target] = path
+    dumper = Dumper(None if ndjson else indent, ensure_ascii=ensure_ascii)
+    state = (dialect, out_dir, ndjson, filters or {}, dumper)
+    if jobs > 1:
+        import multiprocessing
+        from functools import partial
+        from concurrent.futures import ProcessPoolExecutor
+        context = multiprocessing.get_context(start_method)
+        config = xmljson._share_state(state, context.get_start_method())
+        # mp_context needs Python 3.7+
+        pool = ProcessPoolExecutor(jobs, **({} if start_method is None else
+                                            {'mp_context': context}))
+        results = pool.map(partial(_convert_task, config), files,
+                           chunksize=max(1, min(64, len(files) // jobs)))
+    else:
+        pool = None
+        _init_bulk(*state)
+        results = (convert_file(task) for task in files)
+    converted, total, failures = 0, 0, []
+    try:
+        for path, size, line, error in results:
+            if error is not None:
+                failures.append((path, error))
+                continue
+            converted += 1
+            total += size
+            if line is not None:
+                out.write(line)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if ndjson:
+            out.close()
+    duration = max(time.time() - start, 1e-6)
+    log.write('xmljson: converted %d of %d files (%.1f MB) in %.2fs: %.1f files/s, %.2f MB/s\n' % (
+        converted, len(files), total / 1e6, duration, converted / duration,
+        total / 1e6 / duration))
+    for path, error in failures:
+        log.write('xmljson: failed %s: %s\n' % (path, error))
+    return len(failures)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''
+Convert XML records from an asyncio byte stream. See ``XMLData.aiter_data()``. Python 3.6+.
+
+The bytes are fed to a pull parser as they arrive. Records are found by the same code as
+``.iterdata()``. Its event source, ``_pull_events()``, yields ``(None, None)`` when the parser
+has no more events, and reading resumes from the stream.
+'''
+
+import asyncio
+from functools import partial
+from . import _clear, _filter_events, _iterrecords, _pull_events
+try:
+    from lxml.etree import XMLPullParser
+except ImportError:
+    from xml.etree.ElementTree import XMLPullParser
+
+
+def _available(records):
+    '''Return the records available now'''
+    result = []
+    for elem in records:
+        if elem is None:
+            break
+        result.append(elem)
+    return result
+
+
+def _convert(dialect, elems, kwargs):
+    '''Return .data() for each record'''
+    return [dialect.data(elem, **kwargs) for elem in elems]
+
+
+async def _chunks(stream, size=65536):
+    '''Yield chunks of bytes from stream, which has an async read(size) or is async iterable'''
+    read = getattr(stream, 'read', None)
+    if read is None:
+        async for chunk in stream:
+            yield chunk
+    else:
+        while True:
+            chunk = await read(size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def aiter_data(dialect, stream, tag, include, exclude, executor, executor_size, kwargs):
+    '''Yield dialect.data(record, **kwargs) for each record matching tag in stream'''
+    parser = XMLPullParser(events=('start', 'end'))
+    events = _pull_events(parser)
+    if include is not None or exclude is not None:
+        events = _filter_events(events, include, exclude)
+    # Records are cleared after they are converted, not when the next one is read
+    cleared = []
+    records = _iterrecords(events, tag, cleared)
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    async for chunk in _chunks(stream):
+        # lxml parsers must stay in the thread that created them. So the parser is fed, its
+        # events are read and the tree is cleared in the event loop. Parsing is fast anyway
+        parser.feed(chunk)
+        if executor_size is not None and len(chunk) >= executor_size:
+            # Converting the records of a large chunk takes long. Do it outside the event loop.
+            # (This generator waits for the result, so the tree does not change meanwhile)
+            elems = _available(records)
+            values = await loop.run_in_executor(
+                executor, partial(_convert, dialect, elems, kwargs))
+            _clear(cleared)
+            for value in values:
+                yield value
+            continue
+        # Yield each record as soon as it is converted
+        for elem in records:
+            if elem is None:
+                break
+            yield dialect.data(elem, **kwargs)
+        _clear(cleared)
+    parser.close()
+    for value in _convert(dialect, _available(records), kwargs):
+        yield value
+    _clear(cleared)
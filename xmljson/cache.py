@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+Cache conversions of XML documents that are converted again and again. See ``XMLData.cache()``.
+
+Entries are keyed by a SHA-256 hash of the document, the dialect's class and options, and the
+``.data()`` keyword arguments. The most recently used entries are kept in memory. With a path,
+entries are also stored in an SQLite file, which other processes and later runs can share.
+
+Callers may change the data they get, so the cache keeps a pickle of it and returns a fresh
+copy each time. Frozen data (from ``shared=True``) cannot change, and is returned as-is.
+'''
+
+import sqlite3
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from . import __version__, fromstring
+
+
+def _config(dialect):
+    '''Return bytes that identify dialect's class and options, or None if they cannot be
+    pickled. Functions and classes (e.g. xml_fromstring, dict_type) are identified by name'''
+    cls = dialect.__class__
+    try:
+        return pickle.dumps((__version__, cls.__module__, cls.__name__,
+                             sorted(dialect._options.items())), 2)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+
+class Cache(object):
+    '''Converts XML documents with dialect.data(), remembering the results.
+
+    size is the number of entries kept in memory. path is an SQLite file that stores all
+    entries, or None. The counts of .hits (from memory), .disk_hits and .misses show how well
+    the cache works.
+    '''
+    def __init__(self, dialect, size=1024, path=None):
+        self.dialect, self.size, self.path = dialect, size, path
+        self.hits = self.disk_hits = self.misses = 0
+        self._frozen = dialect._shared is not None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._config = _config(dialect)
+        self._db = None
+        if path is not None:
+            # A function that is not importable by name (e.g. a lambda) may not be the same in
+            # another process. So its entries cannot be shared
+            if self._config is None:
+                raise ValueError('Dialect options must be picklable to cache on disk')
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS xmljson (key BLOB PRIMARY KEY, '
+                             'value BLOB NOT NULL)')
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __repr__(self):
+        return '<Cache hits=%d disk_hits=%d misses=%d entries=%d>' % (
+            self.hits, self.disk_hits, self.misses, len(self._memory))
+
+    def key(self, doc, **kwargs):
+        '''Return the cache key for .convert(doc, **kwargs)'''
+        digest = hashlib.sha256(self._config or b'')
+        if kwargs:
+            digest.update(pickle.dumps(sorted(kwargs.items()), 2))
+        digest.update(b'\0')
+        digest.update(doc if isinstance(doc, bytes) else doc.encode('utf-8'))
+        return digest.digest()
+
+    def convert(self, doc, **kwargs):
+        '''Return dialect.data(fromstring(doc), **kwargs), from the cache if possible.
+
+        doc is an XML document as bytes or a string. Keyword arguments (e.g. include, exclude,
+        preserve_root) go to .data(), and are part of the key.
+        '''
+        key = self.key(doc, **kwargs)
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory[key] = entry
+                self.hits += 1
+            elif self._db is not None:
+                row = self._db.execute('SELECT value FROM xmljson WHERE key = ?',
+                                       (sqlite3.Binary(key), )).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    entry = bytes(row[0])
+                    if self._frozen:
+                        entry = pickle.loads(entry)
+                    self._store(key, entry)
+        if entry is not None:
+            return entry if self._frozen else pickle.loads(entry)
+
+        value = self.dialect.data(fromstring(doc), **kwargs)
+        pickled = None
+        if not self._frozen or self._db is not None:
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self.misses += 1
+            self._store(key, value if self._frozen else pickled)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO xmljson VALUES (?, ?)',
+                                 (sqlite3.Binary(key), sqlite3.Binary(pickled)))
+        return value
+
+    def _store(self, key, entry):
+        '''Add an entry to memory, dropping the least recently used. Call with the lock held'''
+        memory = self._memory
+        memory[key] = entry
+        while len(memory) > self.size:
+            memory.popitem(last=False)
+
+    def clear(self):
+        '''Remove all entries from memory and disk, and reset the counts'''
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.disk_hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM xmljson')
+
+    def close(self):
+        '''Close the SQLite file'''
+        if self._db is not None:
+            self._db.close()
+            self._db = None
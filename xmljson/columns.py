@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+'''
+Convert repeating records into columns. See ``XMLData.columns()``.
+
+Each record's ``.data()`` is flattened into (column, value) pairs. Nested keys are joined with
+``/``, so the columns use the dialect's own names: ``<row id="1"><name>a</name></row>`` has the
+columns ``@id`` and ``name/$`` in BadgerFish, and ``id`` and ``name`` in Parker. Lists (from
+repeated tags) are kept as one value. Empty dicts, and empty records, add no column.
+
+Records that lack a column have a gap there. Gaps become ``missing`` in lists. NumPy columns
+with gaps are masked arrays.
+
+``pack()`` uses the same typing for ``XMLData(pack=True)``: lists of numbers in ``.data()``
+become arrays.
+'''
+
+import sys
+from array import array
+from . import _children, _iterrecords, _parse_events, paths
+
+# Python 3: define long as int
+if sys.version_info[0] == 3:
+    long = int
+
+
+class _Gap(object):
+    '''Marks a value missing from a record, until columns are finished'''
+    __slots__ = ()
+
+
+_gap = _Gap()
+_ints = set([int, long])
+_numbers = set([int, long, float])
+
+
+def records(source, tag, include=None, exclude=None):
+    '''Yield the elements matching tag in source: an element, or a filename or file object.
+
+    Elements in a tree are found without changing it. Files are parsed incrementally, skipping
+    elements that include / exclude filter out (see .iterdata()). Records are cleared when the
+    next one is read.
+    '''
+    if not hasattr(source, 'attrib'):
+        for elem in _iterrecords(_parse_events(source, include, exclude), tag):
+            yield elem
+        return
+    match = paths.matcher(tag)
+    tags = list(paths.ancestors(source))
+    stack = [iter([source])]
+    while stack:
+        for elem in stack[-1]:
+            tags.append(elem.tag)
+            if match(tags):
+                # Records nested inside a record are part of it
+                yield elem
+                tags.pop()
+            else:
+                stack.append(iter(_children(elem)))
+            break
+        else:
+            stack.pop()
+            if stack:
+                tags.pop()
+
+
+def _flatten(value, row):
+    '''Append (column, value) pairs for a nested dict to row. Nested keys are joined by /'''
+    stack = [('', iter(value.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for key, item in items:
+            if isinstance(item, dict):
+                if item:
+                    stack.append((prefix + key + '/', iter(item.items())))
+                    break
+            else:
+                row.append((prefix + key, item))
+        else:
+            stack.pop()
+
+
+class Columns(object):
+    '''Collects records converted by dialect into lists of values, one per column.
+    names are columns to include even if no record has them (e.g. from an earlier batch)'''
+    def __init__(self, dialect, names=()):
+        self.dialect = dialect
+        self.columns = dialect.dict((name, []) for name in names)
+        # Columns with gaps
+        self.gaps = set()
+        self.count = 0
+
+    def add(self, elem, value):
+        '''Add a record: elem's .data() value'''
+        if self.dialect._keyed:
+            value = next(iter(value.values()))
+        row = []
+        if isinstance(value, dict):
+            _flatten(value, row)
+        elif value is not None:
+            # A record that is just a value (e.g. <row>1</row> in Parker) is a column of its own
+            row.append((self.dialect._tags[elem.tag], value))
+        columns, count = self.columns, self.count
+        for name, item in row:
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [_gap] * count
+                if count:
+                    self.gaps.add(name)
+            column.append(item)
+        self.count = count = count + 1
+        # Columns are unique in a row. If the row has fewer, pad the others
+        if len(row) < len(columns):
+            for name, column in columns.items():
+                if len(column) < count:
+                    column.append(_gap)
+                    self.gaps.add(name)
+
+    def finish(self, missing=None, arrays=None):
+        '''Return {column: values}. arrays=None returns lists. arrays='array' returns an
+        array.array for int and float columns without gaps. arrays='numpy' returns NumPy arrays
+        (masked where there are gaps), with bool, int64, float64 or object values'''
+        numpy = None
+        if arrays == 'numpy':
+            import numpy
+        elif arrays not in (None, 'array'):
+            raise ValueError('arrays can be None, "array" or "numpy", not %r' % (arrays, ))
+        columns = self.columns
+        for name, column in columns.items():
+            gaps = name in self.gaps
+            if numpy is not None:
+                column = _numpy(numpy, column, gaps)
+            else:
+                if arrays == 'array' and not gaps:
+                    column = _array(column)
+                if gaps:
+                    column = [missing if item is _gap else item for item in column]
+            columns[name] = column
+        return columns
+
+
+def _kind(column):
+    '''Return bool, int or float if the values (except gaps) are all of that type, else None.
+    A mix of ints and floats is float'''
+    kinds = set(map(type, column))
+    kinds.discard(_Gap)
+    if not kinds:
+        return None
+    if kinds == set([bool]):
+        return bool
+    if kinds <= _ints:
+        return int
+    if kinds <= _numbers:
+        return float
+    return None
+
+
+def _array(column):
+    '''Return an array.array for int and float columns (if the ints fit), else the list'''
+    kind = _kind(column)
+    try:
+        if kind is int:
+            return array('q', column)
+        if kind is float:
+            return array('d', column)
+    except (OverflowError, ValueError):
+        # Python 2 has no 'q' arrays
+        pass
+    return column
+
+
+def _numpy(numpy, column, gaps):
+    '''Return a NumPy array of the column's type. Gaps are masked'''
+    kind = _kind(column)
+    dtype = {bool: bool, int: numpy.int64, float: numpy.float64}.get(kind, object)
+    if gaps:
+        mask = [item is _gap for item in column]
+        filler = None if dtype is object else kind(0)
+        column = [filler if item is _gap else item for item in column]
+    values = None
+    if dtype is not object:
+        try:
+            values = numpy.array(column, dtype=dtype)
+        except OverflowError:
+            # Ints larger than 64 bits stay Python ints
+            pass
+    if values is None:
+        # numpy.array() would turn lists of lists into 2D arrays. Fill one value at a time
+        values = numpy.empty(len(column), dtype=object)
+        for index, item in enumerate(column):
+            values[index] = item
+    return numpy.ma.array(values, mask=mask) if gaps else values
+
+
+def pack(value):
+    '''Replace lists of ints in value with array('q') and lists of numbers with array('d').
+    Returns value, changed in place (or the array, if value itself is such a list). Values
+    that are not dicts or lists (e.g. Parker's data for a leaf root) are returned as-is'''
+    if isinstance(value, list):
+        packed = _array(value)
+        if packed is not value:
+            return packed
+    elif not isinstance(value, dict):
+        return value
+    stack = [value]
+    while stack:
+        node = stack.pop()
+        for key, item in (node.items() if isinstance(node, dict) else enumerate(node)):
+            if isinstance(item, list):
+                packed = _array(item)
+                if packed is item:
+                    stack.append(item)
+                else:
+                    node[key] = packed
+            elif isinstance(item, dict):
+                stack.append(item)
+    return value
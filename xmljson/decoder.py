@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+Read JSON incrementally from a file object as a stream of events.
+
+``iterevents(source)`` yields ``(event, value)`` pairs, reading the source in chunks:
+
+- ``('start_map', None)``, ``('map_key', key)``, ``('end_map', None)``
+- ``('start_array', None)``, ``('end_array', None)``
+- ``('string', str)``, ``('number', int or float)``, ``('boolean', bool)``, ``('null', None)``
+
+Numbers, strings and literals are decoded like ``json.loads`` does.
+'''
+
+import re
+import sys
+import codecs
+from collections import OrderedDict
+from json.decoder import scanstring
+from json.scanner import NUMBER_RE
+
+# Python 3: define unicode() as str()
+if sys.version_info[0] == 3:
+    unicode = str
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_literals = [('true', 'boolean', True), ('false', 'boolean', False), ('null', 'null', None),
+             ('NaN', 'number', float('nan')), ('Infinity', 'number', float('inf')),
+             ('-Infinity', 'number', float('-inf'))]
+_longest_literal = max(len(text) for text, event, value in _literals)
+_scalars = frozenset(['string', 'number', 'boolean', 'null'])
+
+# Parser states: what can come next
+_VALUE, _VALUE_OR_END, _KEY, _KEY_OR_END, _AFTER_VALUE = range(5)
+
+
+class _Reader(object):
+    '''A buffer over a text or binary (UTF-8) file object that is read in chunks'''
+    def __init__(self, source, size):
+        self.source = source
+        self.size = size
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = None
+
+    def more(self):
+        '''Read more text. Reads at least as much as is pending, so retries stay linear'''
+        if self.eof:
+            return False
+        data = self.source.read(max(self.size, len(self.buffer) - self.pos))
+        self.eof = not data
+        if isinstance(data, bytes) and not isinstance(data, unicode):
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+            data = self.decoder.decode(data, final=self.eof)
+        if data:
+            self.buffer += data
+        return not self.eof
+
+    def peek(self):
+        '''Skip whitespace and return the next character ('' at the end)'''
+        # Drop text that has been read, between tokens
+        if self.pos >= self.size:
+            self.buffer, self.pos = self.buffer[self.pos:], 0
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                return ''
+
+    def error(self, message):
+        return ValueError('%s: %r' % (message, self.buffer[self.pos:self.pos + 20]))
+
+    def string(self):
+        '''Read a string starting at the current '"' '''
+        while True:
+            try:
+                text, end = scanstring(self.buffer, self.pos + 1, True)
+            except ValueError:
+                if self.more():
+                    continue
+                raise
+            self.pos = end
+            return text
+
+    def scalar(self):
+        '''Read a number or literal. Return (event, value)'''
+        while True:
+            match = NUMBER_RE.match(self.buffer, self.pos)
+            end = match.end() if match is not None else self.pos
+            # A number may continue in the next chunk, so make sure there is more text after it
+            ahead = max(end + 1, self.pos + _longest_literal)
+            if ahead > len(self.buffer) and self.more():
+                continue
+            break
+        for text, event, value in _literals:
+            if self.buffer.startswith(text, self.pos):
+                self.pos += len(text)
+                return event, value
+        if match is None:
+            raise self.error('Expecting value')
+        integer, fraction, exponent = match.groups()
+        self.pos = end
+        if fraction or exponent:
+            return 'number', float(integer + (fraction or '') + (exponent or ''))
+        return 'number', int(integer)
+
+
+def iterevents(source, size=65536):
+    '''Yield (event, value) pairs for the JSON in a file object, reading size characters at a
+    time. Memory use depends on the size of the largest string or number, not the document.
+    '''
+    reader = _Reader(source, size)
+    stack = []
+    state = _VALUE
+    while True:
+        char = reader.peek()
+        if state == _AFTER_VALUE:
+            if not stack:
+                if char:
+                    raise reader.error('Extra data')
+                return
+            if char == ',':
+                reader.pos += 1
+                state = _KEY if stack[-1] == '}' else _VALUE
+            elif char == stack[-1]:
+                reader.pos += 1
+                stack.pop()
+                yield ('end_map' if char == '}' else 'end_array'), None
+            else:
+                raise reader.error('Expecting "," or "%s"' % stack[-1])
+        elif state in (_KEY, _KEY_OR_END):
+            if char == '"':
+                yield 'map_key', reader.string()
+                if reader.peek() != ':':
+                    raise reader.error('Expecting ":"')
+                reader.pos += 1
+                state = _VALUE
+            elif char == '}' and state == _KEY_OR_END:
+                reader.pos += 1
+                stack.pop()
+                yield 'end_map', None
+                state = _AFTER_VALUE
+            else:
+                raise reader.error('Expecting property name enclosed in double quotes')
+        elif char == ']' and state == _VALUE_OR_END:
+            reader.pos += 1
+            stack.pop()
+            yield 'end_array', None
+            state = _AFTER_VALUE
+        elif char == '{':
+            reader.pos += 1
+            stack.append('}')
+            yield 'start_map', None
+            state = _KEY_OR_END
+        elif char == '[':
+            reader.pos += 1
+            stack.append(']')
+            yield 'start_array', None
+            state = _VALUE_OR_END
+        elif char == '"':
+            yield 'string', reader.string()
+            state = _AFTER_VALUE
+        elif not char:
+            raise reader.error('Unexpected end of JSON')
+        else:
+            yield reader.scalar()
+            state = _AFTER_VALUE
+
+
+def value(event, events, dict_type=OrderedDict):
+    '''Return the value that starts with (event, value) and continues in the events iterator'''
+    event, data = event
+    if event in _scalars:
+        return data
+    if event == 'start_map':
+        result = dict_type()
+        for event, key in events:
+            if event == 'end_map':
+                return result
+            result[key] = value(next(events), events, dict_type)
+    if event == 'start_array':
+        result = []
+        for event in events:
+            if event[0] == 'end_array':
+                return result
+            result.append(value(event, events, dict_type))
+    raise ValueError('Unexpected JSON event %s' % event)
+
+
+def skip(event, events):
+    '''Skip the value that starts with (event, value) without building it'''
+    depth = 0 if event[0] in _scalars else 1
+    while depth:
+        kind = next(events)[0]
+        if kind in ('start_map', 'start_array'):
+            depth += 1
+        elif kind in ('end_map', 'end_array'):
+            depth -= 1
+
+
+def is_scalar(event):
+    '''Check if an (event, value) pair is a string, number, boolean or null'''
+    return event[0] in _scalars
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Write JSON text exactly like ``json.dumps(value)``, in pieces.
+
+``Raw`` values are JSON text that is already encoded. They are written as-is. This lets a
+converter encode each element once it is complete and discard it, instead of building the
+whole data structure first.
+'''
+
+import sys
+from json.encoder import encode_basestring_ascii
+
+# Python 3: define unicode() as str()
+if sys.version_info[0] == 3:
+    unicode = str
+    basestring = str
+    long = int
+
+
+class Raw(unicode):
+    '''JSON text that is inserted as-is'''
+    __slots__ = ()
+
+
+def _float(value):
+    '''Encode a float like json.dumps does (including NaN and Infinity)'''
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == float('-inf'):
+        return '-Infinity'
+    return float.__repr__(value)
+
+
+def _key(key):
+    '''Encode a dict key like json.dumps does'''
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, float):
+        return '"%s"' % _float(key)
+    if isinstance(key, (int, long)):
+        return '"%s"' % int.__repr__(key)
+    raise TypeError('keys must be str, int, float, bool or None, not %s' % type(key).__name__)
+
+
+def iterencode(value):
+    '''Yield pieces of json.dumps(value). Raw values are yielded as-is'''
+    if isinstance(value, Raw):
+        yield value
+    elif isinstance(value, basestring):
+        yield encode_basestring_ascii(value)
+    elif value is None:
+        yield 'null'
+    elif value is True:
+        yield 'true'
+    elif value is False:
+        yield 'false'
+    elif isinstance(value, (int, long)):
+        yield int.__repr__(value)
+    elif isinstance(value, float):
+        yield _float(value)
+    elif isinstance(value, dict):
+        if not value:
+            yield '{}'
+            return
+        separator = '{'
+        for key, item in value.items():
+            yield separator + _key(key) + ': '
+            for piece in iterencode(item):
+                yield piece
+            separator = ', '
+        yield '}'
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            yield '[]'
+            return
+        separator = '['
+        for item in value:
+            yield separator
+            for piece in iterencode(item):
+                yield piece
+            separator = ', '
+        yield ']'
+    else:
+        raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+
+def encode(value):
+    '''Return json.dumps(value) as Raw text'''
+    return Raw(''.join(iterencode(value)))
+
+
+def write(value, out, size=65536):
+    '''Write json.dumps(value) to the file object out, buffering pieces into large writes'''
+    buffer, length = [], 0
+    for piece in iterencode(value):
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            out.write(''.join(buffer))
+            buffer, length = [], 0
+    if buffer:
+        out.write(''.join(buffer))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+Convert XML that arrives in chunks, pushed by the caller. See ``XMLData.feeder()``.
+
+A ``Feeder`` feeds the chunks to an ``XMLPullParser`` and converts each record as soon as it
+ends. The stream may hold several documents one after another. A parser rejects anything after
+the end of its root element, so the chunks are split where the root element ends, and each
+document gets its own parser.
+
+The root element ends at ``</root>``. So, once it starts, a chunk is fed up to each ``</root>``
+in it, and the feeder checks if the parser has left the root. (``</root>`` inside a comment or a
+nested ``<root>`` just continues.) Before the root starts, chunks are fed up to each ``>``,
+which finds ``<root/>`` too. Input must be UTF-8 or another encoding where ``<``, ``/`` and
+``>`` are single ASCII bytes.
+'''
+
+import re
+from collections import deque
+from . import _filter_events, _iterrecords
+try:
+    from lxml.etree import XMLPullParser
+except ImportError:
+    from xml.etree.ElementTree import XMLPullParser
+
+_space = re.compile(br'\s*')
+
+
+class Feeder(object):
+    '''Converts XML fed with .feed(data) into records. Use XMLData.feeder() to create one.
+
+    Each record is passed to callback(record) if given, else queued for .read_records().
+    '''
+    def __init__(self, dialect, tag, callback, include, exclude, kwargs):
+        self.dialect = dialect
+        self.tag = '/*' if tag is None else tag
+        self.callback = callback
+        self.include, self.exclude, self.kwargs = include, exclude, kwargs
+        self.queue = deque()
+        self._parser = None
+        # Regex for the root's end tag. None until the root starts
+        self._end = None
+        # Bytes held back in case they start a root end tag that the next chunk completes
+        self._tail = b''
+
+    def feed(self, data):
+        '''Parse bytes, converting the records they complete'''
+        data, self._tail = self._tail + data, b''
+        while data:
+            if self._parser is None:
+                # Skip whitespace between documents
+                data = data[_space.match(data).end():]
+                if not data:
+                    break
+                self._open()
+            if self._end is None:
+                end = data.find(b'>') + 1
+                if not end:
+                    # lxml may report the root's start late. Hold back a partial tag, since
+                    # it may be </root>
+                    start = data.rfind(b'<')
+                    if start >= 0:
+                        data, self._tail = data[:start], data[start:]
+                    end = len(data)
+            else:
+                match = self._end.search(data)
+                if match is None:
+                    # Hold back a possible start of </root> at the end of the chunk
+                    start = data.rfind(b'<')
+                    if 0 <= start and data[start + 1:start + 2] in (b'/', b'') and \
+                            len(data) - start <= self._hold:
+                        data, self._tail = data[:start], data[start:]
+                    end = len(data)
+                else:
+                    end = match.end()
+            if end:
+                self._feed(data[:end])
+            data = data[end:]
+
+    def close(self):
+        '''Parse what is left and finish. Raises an error if the last document is incomplete.
+        Content after the last document's root element with no root element of its own (e.g.
+        a comment) is ignored'''
+        data, self._tail = self._tail, b''
+        if data:
+            self._feed(data)
+        if self._parser is not None and self._end is not None:
+            self._close()
+        self._parser = None
+
+    def read_records(self):
+        '''Yield and remove the records converted so far (if there is no callback)'''
+        queue = self.queue
+        while queue:
+            yield queue.popleft()
+
+    def _open(self):
+        '''Start a new document'''
+        self._parser = XMLPullParser(events=('start', 'end'))
+        self._end, self._depth, self._fresh = None, 0, True
+        events = self._events(self._parser)
+        if self.include is not None or self.exclude is not None:
+            events = _filter_events(events, self.include, self.exclude)
+        self._records = _iterrecords(events, self.tag)
+
+    def _events(self, parser):
+        '''Like _pull_events(), but tracks the depth and the root's end tag'''
+        depth = 0
+        while True:
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if self._end is None:
+                        # '{namespace}tag' is written as 'tag' or 'prefix:tag'
+                        name = elem.tag.rsplit('}', 1)[-1].encode('utf-8')
+                        self._end = re.compile(
+                            br'</(?:[^\s>/:]+:)?' + re.escape(name) + br'\s*>')
+                        self._hold = len(name) + 64
+                    depth += 1
+                else:
+                    depth -= 1
+                yield event, elem
+            self._depth = depth
+            yield None, None
+
+    def _feed(self, data):
+        '''Feed data to the parser and convert completed records. Close the document if done'''
+        if self._fresh:
+            # lxml only sets up the parser with (up to 4 bytes of) the first data fed to it. So
+            # feed 1 byte first. Otherwise, a document like <a/> is not parsed until more comes
+            self._parser.feed(data[:1])
+            data, self._fresh = data[1:], False
+        self._parser.feed(data)
+        self._convert()
+        if self._end is not None and self._depth == 0:
+            self._close()
+
+    def _close(self):
+        self._parser.close()
+        self._convert()
+        self._parser = None
+
+    def _convert(self):
+        dialect, callback, kwargs = self.dialect, self.callback, self.kwargs
+        for elem in self._records:
+            if elem is None:
+                break
+            value = dialect.data(elem, **kwargs)
+            if callback is None:
+                self.queue.append(value)
+            else:
+                callback(value)
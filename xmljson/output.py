@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+Encode JSON with the fastest library installed, and write it to files in large pieces.
+
+``Dumper`` uses ``orjson``, ``ujson`` or ``rapidjson`` if one is installed and supports the
+indent, else the standard ``json`` module. Like ``json.dumps()``, non-ASCII characters are
+written as ``\\uXXXX`` by default. With ``ensure_ascii=False``, every library writes them
+as-is, in UTF-8. ``orjson`` cannot escape them, so values with non-ASCII characters are then
+encoded with ``json``. So are values a library rejects (e.g. integers larger than 64 bits for
+``orjson``). ``orjson`` writes NaN and Infinity as ``null``.
+
+``Output`` collects the encoded bytes and writes them to the binary buffer of a file.
+'''
+
+import io
+import re
+import json
+from functools import partial
+
+libraries = ('orjson', 'ujson', 'rapidjson', 'json')
+
+_non_ascii = re.compile(b'[\x80-\xff]')
+
+
+def _orjson(indent, ensure_ascii):
+    import orjson
+    if indent is None:
+        dumps = orjson.dumps
+    elif indent == 2:
+        dumps = partial(orjson.dumps, option=orjson.OPT_INDENT_2)
+    else:
+        return None
+    if not ensure_ascii:
+        return dumps
+
+    def dumps_ascii(value):
+        data = dumps(value)
+        # Let Dumper encode values with non-ASCII characters with json
+        if _non_ascii.search(data) is not None:
+            raise ValueError('orjson cannot escape non-ASCII characters')
+        return data
+
+    return dumps_ascii
+
+
+def _ujson(indent, ensure_ascii):
+    import ujson
+    if indent != 0:
+        dumps = partial(ujson.dumps, ensure_ascii=ensure_ascii, escape_forward_slashes=False,
+                        indent=indent or 0)
+        return lambda value: dumps(value).encode('utf-8')
+
+
+def _rapidjson(indent, ensure_ascii):
+    import rapidjson
+    if indent != 0:
+        dumps = partial(rapidjson.dumps, ensure_ascii=ensure_ascii, indent=indent)
+        return lambda value: dumps(value).encode('utf-8')
+
+
+def _json(indent, ensure_ascii):
+    separators = (',', ':') if indent is None else (',', ': ')
+    dumps = partial(json.dumps, ensure_ascii=ensure_ascii, indent=indent, separators=separators)
+    return lambda value: dumps(value).encode('utf-8')
+
+
+_makers = {'orjson': _orjson, 'ujson': _ujson, 'rapidjson': _rapidjson, 'json': _json}
+
+
+class Dumper(object):
+    '''Encodes values as UTF-8 JSON bytes. indent=None writes compact JSON on one line.
+    ensure_ascii=False writes non-ASCII characters as-is instead of as \\uXXXX.
+
+    library is one of ``libraries``. By default, the first one installed that supports indent
+    is used. The name of the library used is in .library.
+    '''
+    def __init__(self, indent=None, library=None, ensure_ascii=True):
+        self.indent, self.ensure_ascii = indent, ensure_ascii
+        self._json = _json(indent, ensure_ascii)
+        for name in libraries if library is None else [library]:
+            try:
+                dumps = _makers[name](indent, ensure_ascii)
+            except ImportError:
+                if library is not None:
+                    raise
+                continue
+            if dumps is not None:
+                self.library, self._dumps = name, dumps
+                break
+        else:
+            raise ValueError('%s cannot indent by %r' % (library, indent))
+
+    def __getstate__(self):
+        return {'indent': self.indent, 'library': self.library,
+                'ensure_ascii': self.ensure_ascii}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def dumps(self, value):
+        '''Return value as JSON bytes'''
+        try:
+            return self._dumps(value)
+        except (TypeError, ValueError, OverflowError):
+            # Let json raise its own error, or encode what the faster library could not
+            if self.library == 'json':
+                raise
+            return self._json(value)
+
+
+class Output(object):
+    '''Writes bytes to a file in pieces of at least size bytes. Call .flush() at the end.
+
+    Text files are written to through their binary .buffer (as UTF-8). Text files with no
+    buffer (e.g. io.StringIO) are written decoded text.
+    '''
+    def __init__(self, out, size=262144):
+        self.out, self.size = out, size
+        self.pieces, self.length = [], 0
+        self.binary = out
+        if isinstance(out, io.TextIOBase):
+            self.binary = getattr(out, 'buffer', None)
+            # Write what is already in the text layer before writing beneath it
+            out.flush()
+
+    def write(self, data):
+        self.pieces.append(data)
+        self.length += len(data)
+        if self.length >= self.size:
+            self._write()
+
+    def _write(self):
+        data = b''.join(self.pieces)
+        self.pieces, self.length = [], 0
+        if self.binary is None:
+            self.out.write(data.decode('utf-8'))
+        else:
+            self.binary.write(data)
+
+    def flush(self):
+        '''Write everything collected so far to the file'''
+        if self.pieces:
+            self._write()
+        (self.out if self.binary is None else self.binary).flush()
+
+    close = flush
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+'''
+Tag paths select elements (and attributes) by their position in a document.
+
+- ``item`` matches any ``<item>``
+- ``channel/item`` matches ``<item>`` whose parent is ``<channel>``
+- ``/rss/channel/item`` matches only from the root of the document
+- ``*`` matches any tag, e.g. ``channel/*``, but not attributes
+- ``item/@id`` matches the ``id`` attribute of ``<item>``. ``@id`` matches any ``id`` attribute
+- ``item/@*`` matches any attribute of ``<item>``
+- ``{urn:x}item`` matches ``<item>`` in the namespace ``urn:x`` (as lxml writes tags), even if
+  the namespace has a ``/``
+'''
+
+import re
+
+_part = re.compile(r'@?\{[^}]*\}[^/]*|[^/]+')
+
+
+def split(path):
+    '''Return (anchored, parts) for a path, e.g. '/a/b' -> (True, ['a', 'b'])'''
+    return path.startswith('/'), _part.findall(path) or ['']
+
+
+def matcher(path):
+    '''Return fn(tags) that checks if a sequence of tags (root first) matches path'''
+    anchored, parts = split(path)
+    size = len(parts)
+
+    def match(tags):
+        if len(tags) < size or (anchored and len(tags) != size):
+            return False
+        for part, tag in zip(parts, tags[-size:]):
+            if part == '*' or part == '@*':
+                # Attributes are '@name'. Tags never start with @
+                if (part == '@*') != tag.startswith('@'):
+                    return False
+            elif part != tag:
+                return False
+        return True
+
+    return match
+
+
+def ancestors(node):
+    '''Return a tuple of the tags above node, root first. Empty if the tree has no parent links'''
+    if not hasattr(node, 'iterancestors'):
+        return ()
+    return tuple(reversed([parent.tag for parent in node.iterancestors()]))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''
+Convert values by their tag path instead of guessing their type.
+
+A ``Schema`` maps tag paths (see ``xmljson.paths``) to converters. It is built from a
+``{path: type}`` dict or from an XSD file. Paths are matched from the root of the document.
+'''
+
+import sys
+from collections import OrderedDict
+from . import paths
+
+try:
+    from lxml.etree import parse
+except ImportError:
+    from xml.etree.cElementTree import parse
+
+# Python 3: define unicode() as str()
+if sys.version_info[0] == 3:
+    unicode = str
+
+XS = '{http://www.w3.org/2001/XMLSchema}'
+
+
+def _boolean(value):
+    '''Convert an xs:boolean string ("true", "false", "1", "0") to bool'''
+    value = value.strip()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError('Not a boolean: %r' % value)
+
+
+def _string(value):
+    '''Keep the string as-is'''
+    return value
+
+
+# XSD built-in types that are not strings. All other types (string, date, ...) stay strings
+_xsd_types = {'boolean': _boolean, 'decimal': float, 'float': float, 'double': float}
+for _name in ['integer', 'int', 'long', 'short', 'byte', 'nonNegativeInteger',
+              'positiveInteger', 'nonPositiveInteger', 'negativeInteger', 'unsignedLong',
+              'unsignedInt', 'unsignedShort', 'unsignedByte']:
+    _xsd_types[_name] = int
+
+# Python types that need a different converter than calling the type
+_python_types = {bool: _boolean, str: _string, unicode: _string}
+
+
+def converter(kind):
+    '''Return a function that converts an XML string to kind.
+
+    kind can be a Python type (``int``, ``float``, ``bool``, ``str``), an XSD type name
+    (``'xs:int'``, ``'boolean'``) or any callable. None is returned as None.
+    '''
+    if isinstance(kind, (str, unicode)):
+        fn = _xsd_types.get(kind.split(':')[-1], _string)
+    elif kind in _python_types:
+        fn = _python_types[kind]
+    elif callable(kind):
+        fn = kind
+    else:
+        raise TypeError('Cannot convert values to %r' % (kind,))
+
+    def convert(value):
+        return None if value is None else fn(value)
+
+    return convert
+
+
+class Schema(object):
+    '''Converters for values at tag paths, e.g. ``Schema({'item/price': float, '@id': int})``'''
+    def __init__(self, types):
+        self.types = types
+        rules = []
+        for index, (path, kind) in enumerate(types.items()):
+            anchored, parts = paths.split(path)
+            # More specific paths win: longer first, then anchored, then in the order given
+            key = (-len(parts), not anchored, index)
+            rules.append((key, paths.matcher(path), converter(kind)))
+        rules.sort(key=lambda rule: rule[0])
+        self.rules = [(match, convert) for key, match, convert in rules]
+        self.cache = {}
+
+    def __reduce__(self):
+        # Matchers are closures, which cannot be pickled. Re-create them from the types
+        return Schema, (self.types, )
+
+    @classmethod
+    def from_xsd(cls, source):
+        '''Create a Schema from an XSD filename, file object or parsed etree'''
+        return cls(xsd_types(source))
+
+    def get(self, path, default=None):
+        '''Return the converter for a tuple of tags (with '@attr' last for attributes)'''
+        try:
+            convert = self.cache[path]
+        except KeyError:
+            convert = self.cache[path] = next(
+                (convert for match, convert in self.rules if match(path)), None)
+        return default if convert is None else convert
+
+
+def _local(name):
+    '''Strip the namespace prefix from a QName like "xs:int" or "tns:Address"'''
+    return name.split(':')[-1] if name else name
+
+
+def xsd_types(source):
+    '''Return {path: xsd-type-name} for elements and attributes with simple types in an XSD.
+
+    Paths are anchored at the global elements, e.g. ``/order/item/@id``. Supports elements,
+    attributes, named and anonymous simple and complex types, extensions, groups and attribute
+    groups. Recursive types are expanded once. Names in the targetNamespace are written as
+    ``{namespace}name``, like lxml tags: global elements and attributes, and local ones whose
+    form (or elementFormDefault / attributeFormDefault) is qualified.
+    '''
+    root = source.getroot() if hasattr(source, 'getroot') else source
+    if not hasattr(root, 'tag'):
+        root = parse(source).getroot()
+    target = root.get('targetNamespace')
+    namespace = '{%s}' % target if target else ''
+
+    def qualify(node, default, top):
+        '''Return the name of an element or attribute node as it appears in documents'''
+        if top or node.get('form', root.get(default)) == 'qualified':
+            return namespace + node.get('name')
+        return node.get('name')
+    named = {}
+    for node in root:
+        if isinstance(node.tag, (str, unicode)) and node.get('name'):
+            named[node.tag, node.get('name')] = node
+    types = OrderedDict()
+
+    def simple_base(node):
+        '''Return the built-in type name of a simple type node (or None)'''
+        for restriction in node.iter(XS + 'restriction'):
+            return type_name(restriction.get('base'))
+
+    def type_name(name):
+        '''Return the built-in type name for a type reference (or None if it is complex)'''
+        name = _local(name)
+        simple = named.get((XS + 'simpleType', name))
+        if simple is not None:
+            return simple_base(simple)
+        if (XS + 'complexType', name) in named:
+            return None
+        return name
+
+    def add(path, name):
+        if name is not None and path not in types:
+            types[path] = name
+
+    def element(node, path, seen, top=False):
+        if node.get('ref'):
+            # A ref to an element that contains it (e.g. a tree of <node>) is followed once
+            name = _local(node.get('ref'))
+            node = named.get((XS + 'element', name))
+            if node is None or ('element', name) in seen:
+                return
+            seen, top = seen | {('element', name)}, True
+        path = path + '/' + qualify(node, 'elementFormDefault', top)
+        kind = node.get('type')
+        if kind is not None:
+            complex = named.get((XS + 'complexType', _local(kind)))
+            if complex is None:
+                add(path, type_name(kind))
+            elif kind not in seen:
+                content(complex, path, seen | {kind})
+        for child in node:
+            if child.tag == XS + 'simpleType':
+                add(path, simple_base(child))
+            elif child.tag == XS + 'complexType':
+                content(child, path, seen)
+
+    def content(node, path, seen):
+        '''Add the attributes, text and child elements of a complex type'''
+        for child in node:
+            tag = child.tag
+            if tag == XS + 'element':
+                element(child, path, seen)
+            elif tag == XS + 'attribute':
+                attribute(child, path)
+            elif tag in (XS + 'extension', XS + 'restriction'):
+                base = child.get('base')
+                complex = named.get((XS + 'complexType', _local(base)))
+                if complex is not None:
+                    if base not in seen:
+                        content(complex, path, seen | {base})
+                elif node.tag == XS + 'simpleContent':
+                    add(path, type_name(base))
+                content(child, path, seen)
+            elif tag in (XS + 'group', XS + 'attributeGroup') and child.get('ref'):
+                group = named.get((tag, _local(child.get('ref'))))
+                if group is not None:
+                    content(group, path, seen)
+            elif tag in (XS + 'sequence', XS + 'choice', XS + 'all', XS + 'complexContent',
+                         XS + 'simpleContent', XS + 'group', XS + 'attributeGroup'):
+                content(child, path, seen)
+
+    def attribute(node, path):
+        top = bool(node.get('ref'))
+        if top:
+            node = named.get((XS + 'attribute', _local(node.get('ref'))))
+            if node is None:
+                return
+        path = path + '/@' + qualify(node, 'attributeFormDefault', top)
+        if node.get('type'):
+            add(path, type_name(node.get('type')))
+        for child in node:
+            if child.tag == XS + 'simpleType':
+                add(path, simple_base(child))
+
+    for node in root:
+        if node.tag == XS + 'element':
+            element(node, '', frozenset(), True)
+    return types
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+'''
+Escape XML text exactly like ``lxml.etree.tostring(elem, encoding='utf-8')`` does.
+
+``XMLData.to_xml_bytes()`` uses these to write ``.etree()``'s output directly, without creating
+elements. Characters that XML does not allow raise the same ``ValueError`` as lxml.
+'''
+
+import re
+
+# Characters that need escaping, or that XML does not allow
+_text_special = re.compile(u'[&<>\r\x00-\x08\x0b\x0c\x0e-\x1f]')
+_attr_special = re.compile(u'[&<>"\n\r\t\x00-\x08\x0b\x0c\x0e-\x1f]')
+_invalid = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_text_escapes = [(u'&', u'&amp;'), (u'<', u'&lt;'), (u'>', u'&gt;'), (u'\r', u'&#13;')]
+_attr_escapes = _text_escapes + [(u'"', u'&quot;'), (u'\n', u'&#10;'), (u'\t', u'&#9;')]
+
+
+class Namespaced(ValueError):
+    '''Raised for {namespace}tag names, which need namespace declarations that only lxml adds'''
+
+
+def _escape(value, escapes):
+    if _invalid.search(value) is not None:
+        raise ValueError('All strings must be XML compatible: Unicode or ASCII, no NULL bytes '
+                         'or control characters')
+    for char, escaped in escapes:
+        value = value.replace(char, escaped)
+    return value
+
+
+def text(value):
+    '''Escape element text'''
+    return value if _text_special.search(value) is None else _escape(value, _text_escapes)
+
+
+def attr(value):
+    '''Escape an attribute value (without the quotes)'''
+    return value if _attr_special.search(value) is None else _escape(value, _attr_escapes)
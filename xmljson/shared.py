@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+'''
+Immutable converted data that shares identical subtrees.
+
+``XMLData(shared=True).data(root)`` returns ``FrozenOrderedDict`` (or, with ``compact=True``,
+``FrozenDict``) objects and tuples. Identical subtrees in a document -- the same ``<address>``
+repeated a thousand times -- are one object, so memory grows with the number of distinct
+subtrees, not the size of the document. Since values are shared, they cannot be changed.
+``.copy()`` returns a mutable copy of one level.
+'''
+
+import sys
+from collections import OrderedDict
+from .view import _read_only
+
+# Python 3: define unicode() as str()
+if sys.version_info[0] == 3:
+    unicode = str
+
+
+class FrozenDict(dict):
+    '''A read-only, hashable dict'''
+    __slots__ = ()
+
+    def __init__(self, items=()):
+        dict.__init__(self, items)
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()), )
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+
+class FrozenOrderedDict(OrderedDict):
+    '''A read-only, hashable OrderedDict'''
+    __slots__ = ()
+
+    def __init__(self, items=()):
+        for key, value in items:
+            OrderedDict.__setitem__(self, key, value)
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def copy(self):
+        return OrderedDict(self)
+
+    def __reduce__(self):
+        return self.__class__, (list(self.items()), )
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = move_to_end = _read_only
+
+
+_frozen = (FrozenDict, FrozenOrderedDict, tuple)
+
+
+class Sharer(object):
+    '''Freezes values, returning the same object for identical values seen before.
+
+    Values are frozen bottom-up, so the children of a new dict or list are already shared. Two
+    subtrees are then identical if their keys and the ids of their children are. Each subtree
+    is compared in time proportional to its number of children, not its size.
+    '''
+    def __init__(self, frozen=FrozenOrderedDict):
+        self.frozen = frozen
+        # Fingerprint -> shared value. Holding the values also keeps their ids valid
+        self.table = {}
+
+    def __call__(self, value):
+        '''Return the shared, frozen version of value'''
+        if isinstance(value, _frozen):
+            return value
+        if isinstance(value, dict):
+            items = [(key, self(item)) for key, item in value.items()]
+            key = (dict, ) + tuple([(key, _fingerprint(item)) for key, item in items])
+            shared = self.table.get(key)
+            if shared is None:
+                shared = self.table[key] = self.frozen(items)
+            return shared
+        if isinstance(value, list):
+            items = tuple([self(item) for item in value])
+            key = (list, ) + tuple([_fingerprint(item) for item in items])
+            return self.table.setdefault(key, items)
+        # Repeated text (e.g. status="active") is stored once too
+        if isinstance(value, unicode):
+            return self.table.setdefault(value, value)
+        return value
+
+    def build(self, build, keyed):
+        '''Wrap a dialect's _build(), sharing each element's value as soon as it is built'''
+        def shared_build(root, children, values, path=None):
+            value = build(root, children, values, path)
+            # Keyed dialects return {tag: value}. The parent copies from this, so share the value
+            if keyed:
+                return dict((key, self(item)) for key, item in value.items())
+            return self(value)
+        return shared_build
+
+
+def _fingerprint(value):
+    '''Identify a shared value: by id for containers, by type and value for scalars'''
+    if isinstance(value, _frozen):
+        return id(value)
+    # 1, 1.0 and True are equal, but are different values. So are 0.0 and -0.0
+    if type(value) is float:
+        return float, value.hex()
+    return type(value), value
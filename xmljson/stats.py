@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+Count what a conversion does and time its phases. See ``XMLData.stats()``.
+'''
+
+import time
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+_timer = getattr(time, 'perf_counter', time.time)
+# Guards the check that a dialect is not already collecting stats
+_lock = threading.Lock()
+
+
+class Stats(object):
+    '''Counts of nodes, attributes, text and converted values, and seconds spent per phase.
+
+    Phases do not overlap: ``data`` excludes the time spent in ``fromstring``.
+    '''
+    phases = ('parse', 'data', 'fromstring', 'serialize')
+
+    def __init__(self):
+        self.nodes = 0
+        self.attributes = 0
+        self.texts = 0
+        # Type of each value returned by xml_fromstring: bool, int, float, str, NoneType, ...
+        self.values = Counter()
+        self.times = OrderedDict((phase, 0.0) for phase in self.phases)
+
+    @contextmanager
+    def time(self, phase):
+        '''Add the time spent in the with block to phase, e.g. ``with stats.time('parse')``'''
+        start = _timer()
+        try:
+            yield
+        finally:
+            self.times[phase] = self.times.get(phase, 0.0) + _timer() - start
+
+    def as_dict(self):
+        return OrderedDict([
+            ('nodes', self.nodes), ('attributes', self.attributes), ('texts', self.texts),
+            ('values', dict(self.values)), ('times', OrderedDict(self.times))])
+
+    def __str__(self):
+        values = ', '.join('%s %d' % (kind, count) for kind, count in self.values.most_common())
+        times = ', '.join('%s %.1fms' % (phase, seconds * 1000) for phase, seconds in
+                          self.times.items())
+        return 'nodes: %d, attributes: %d, texts: %d\nvalues: %s\ntime: %s' % (
+            self.nodes, self.attributes, self.texts, values or '-', times)
+
+
+@contextmanager
+def collect(dialect, stats):
+    '''Count and time every conversion made with dialect in the with block.
+
+    Wraps the instance's data, _build and _fromstring, and restores them when done. Nothing
+    is wrapped outside the block, so there is no cost when stats are not collected.
+
+    The wrappers are set on the dialect, so this is not thread-safe on a shared converter (e.g.
+    xmljson.badgerfish): conversions in other threads are counted too. Blocks on the same
+    dialect cannot overlap. A second one raises a RuntimeError. Use a separate instance per
+    thread instead.
+    '''
+    with _lock:
+        if '_collecting' in dialect.__dict__:
+            raise RuntimeError('stats() is already collecting on this %s. Use another instance '
+                               'per thread' % dialect.__class__.__name__)
+        dialect._collecting = True
+    data, build, fromstring = dialect.data, dialect._build, dialect._fromstring
+    timer, times, counts = _timer, stats.times, stats.values
+
+    def counted_fromstring(value):
+        start = timer()
+        result = fromstring(value)
+        times['fromstring'] += timer() - start
+        counts[type(result).__name__] += 1
+        return result
+
+    def counted_build(root, children, values, path=None):
+        stats.nodes += 1
+        stats.attributes += len(root.attrib)
+        if root.text is not None and root.text.strip():
+            stats.texts += 1
+        return build(root, children, values, path)
+
+    def timed_data(*args, **kwargs):
+        start, coercion = timer(), times['fromstring']
+        try:
+            return data(*args, **kwargs)
+        finally:
+            times['data'] += timer() - start - (times['fromstring'] - coercion)
+
+    wrappers = {'data': timed_data, '_build': counted_build, '_fromstring': counted_fromstring}
+    # Remember attributes set on the instance (e.g. a custom xml_fromstring) to restore them
+    missing = object()
+    saved = {name: dialect.__dict__.get(name, missing) for name in wrappers}
+    dialect.__dict__.update(wrappers)
+    try:
+        yield stats
+    finally:
+        for name, value in saved.items():
+            if value is missing:
+                del dialect.__dict__[name]
+            else:
+                dialect.__dict__[name] = value
+        del dialect._collecting
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''
+Read-only views of converted data that convert each value only when it is first read.
+
+``XMLData.view(root)`` returns a ``View``. Its keys are computed like ``.data()`` does, but each
+child element is left as a ``Pending`` placeholder until it is read. Lists are converted one level
+deep when they are read, since list items can be accessed in any order.
+'''
+
+from collections import OrderedDict
+try:
+    from collections.abc import ItemsView, ValuesView
+except ImportError:
+    from collections import ItemsView, ValuesView
+
+
+class Pending(object):
+    '''An element (at a tag path) whose value is converted when it is first read'''
+    __slots__ = ('elem', 'path')
+
+    def __init__(self, elem, path):
+        self.elem = elem
+        self.path = path
+
+
+# Values that are already converted
+_scalars = (bool, int, float, str, type(u''), type(None))
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError('%s is read-only' % self.__class__.__name__)
+
+
+class View(OrderedDict):
+    '''A read-only mapping like the dict returned by .data(), converted as values are read.
+
+    Converted values are cached. ``json.dumps(view)``, ``dict(view)`` and ``view == data`` read
+    all values, like a dict would. A pickle or ``.copy()`` is a plain OrderedDict.
+    '''
+    def __init__(self, resolve, items):
+        # resolve(value) converts a Pending placeholder (or a list or dict holding them)
+        self._resolve = resolve
+        self._cache = {}
+        for key, value in items:
+            OrderedDict.__setitem__(self, key, value)
+
+    def __getitem__(self, key):
+        value = OrderedDict.__getitem__(self, key)
+        if isinstance(value, _scalars):
+            return value
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = self._resolve(value)
+            return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __iter__(self):
+        # Defining __iter__ also makes dict(view) use keys() and __getitem__, not the raw storage
+        return OrderedDict.__iter__(self)
+
+    def items(self):
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def __eq__(self, other):
+        if isinstance(other, OrderedDict):
+            return len(self) == len(other) and list(self.items()) == list(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self.items()))
+
+    def copy(self):
+        return OrderedDict(self.items())
+
+    def __reduce__(self):
+        return OrderedDict, (list(self.items()), )
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    move_to_end = _read_only